@@ -1,6 +1,11 @@
 import networkx as nx
 import numpy as np
-import operator
+import itertools
+import scipy.optimize as optimize
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from tree_partitions import random_partitions
+from graph_data import GraphData, node_ordering
 import types
 import sys
 
@@ -12,22 +17,38 @@ import sys
 #Functions:
 #
 #canonical_form : converts district assignment list into canonical form partition
+#canonical_array : converts a 2-D array of district assignments (one plan per row) into canonical form
 #dict_to_canon : converts assignment dictionary into canonical form partition
 #partition_to_canon : converts partition object into canonical form partition
 #chain_to_canon : converts chain object into canonical form list of partitions 
 #							which most other functions accept as input
+#iter_chain_canon : same as chain_to_canon but yields steps (or chunks of steps) one at a time
+#						(ensemble_format.save_chain_canon streams them straight to an ensemble file)
 #
 #eff_gap : calculates efficiency gap for a list of canonical form partitions
 #dem_seats : calculates democrat majority districts for a list of canonical form partitions
 #rep_seats : calculates republican majority districts for a list of canonical form partitions
 #mean_med : calculates mean_median for a list of canonical form partitions
 #mean_thi : calculates mean_thirdian for a list of canonical form partitions
+#district_tallies : sums node weights (votes, population) per district for a batch of partitions, the
+#					shared kernel the partisan benchmarks are computed from
+#score_ensemble : calculates any set of the partisan benchmarks, entropy and seat share in one pass over
+#					a list of partitions and outputs them as columns of a structured array
+#score_chain : same as score_ensemble for consecutive steps of a chain, updating district totals
+#					incrementally with a ChainScorer instead of tallying each step from scratch
 #
 #hamming_dist : calculates hamming distances between inputted list of 'towers' (partitions) and 
 # 			a list of canonical form partitions
+#hamming_distances : same as hamming_dist as a (partitions x towers) array, computed in batches from the
+#					contingency tables of district overlaps (contingency_tables, max_weight_matchings)
 #entropy_dist : same as hamming but for entropy distance
+#entropy_distances : same as entropy_dist as a (partitions x towers) array, from the same contingency tables
+#tower_distances : hamming and entropy distances together from a single pass over the partitions
+#track_towers : same as tower_distances for consecutive steps of a chain, updating contingency tables
+#					incrementally with a TowerTracker and only re-solving matchings the bounds can't keep
 #create_towers : generates a number of randomly generated co-distance maximizing partitions
-#					intended to be used as input for hamming and entropy
+#					intended to be used as input for hamming and entropy, drawing candidates with
+#					tree_partitions.random_partitions
 
 
 #----------------------- Canonical form conversion -------------------------------------
@@ -47,6 +68,51 @@ def canonical_form(vector):
 	return tuple(right)
 
 
+#Smallest unsigned integer type able to hold district labels 1 through num_dists
+def label_dtype(num_dists):
+	for dtype in (np.uint8, np.uint16, np.uint32):
+		if num_dists <= np.iinfo(dtype).max:
+			return np.dtype(dtype)
+	return np.dtype(np.uint64)
+
+
+#Vectorized canonical_form for a whole ensemble. Takes an array (or list of equal length tuples) of shape
+#(num_plans x num_nodes) where each row is a plan, and relabels every row by order of first appearance at once
+#instead of building a set, dict and tuple for each plan. The output is an array of the same shape using the
+#smallest unsigned type that fits the districts (uint8 for fewer than 256 districts).
+#A single plan (1-D input) is returned as a 1-D array
+#Ex: canonical_array([[3,1,2,1],[2,2,1,1]]) = array([[1,2,3,2],[1,1,2,2]])
+def canonical_array(plans):
+	plans = np.asarray(plans)
+	if plans.ndim == 1:
+		return canonical_array(plans[np.newaxis])[0]
+	num_plans, num_nodes = plans.shape
+	if plans.size == 0:
+		return np.zeros(plans.shape, dtype = np.uint8)
+
+	#shift labels to 0...num_labels-1 so they can index a (num_plans x num_labels) table, only falling back
+	#to a sort when the labels are sparse (GEOID-like district names) or not numbers
+	if np.issubdtype(plans.dtype, np.number) and plans.max() - plans.min() < max(num_nodes, 256):
+		labels = (plans - plans.min()).astype(np.intp)
+		num_labels = int(labels.max()) + 1
+	else:
+		unique_labels, labels = np.unique(plans, return_inverse = True)
+		labels = labels.reshape(plans.shape)
+		num_labels = len(unique_labels)
+
+	#first[p, l] is the first node of plan p in district l, or num_nodes if plan p doesn't use label l
+	rows = np.arange(num_plans)[:, np.newaxis]
+	first = np.full((num_plans, num_labels), num_nodes, dtype = np.intp)
+	np.minimum.at(first, (rows, labels), np.arange(num_nodes))
+
+	#rank each row's labels by first appearance, unused labels sort last and are never looked up
+	order = np.argsort(first, axis = 1, kind = 'stable')
+	correction_table = np.empty_like(order)
+	np.put_along_axis(correction_table, order, np.arange(1, num_labels + 1)[np.newaxis, :], axis = 1)
+	num_dists = int((first < num_nodes).sum(axis = 1).max())
+	return correction_table[rows, labels].astype(label_dtype(num_dists))
+
+
 #Converts assignment dictionary in the form {node : district} to canonical form
 #assumes nodes are integer indexed from 0 to 1-num_nodes
 def dict_to_canon(dict):
@@ -54,22 +120,38 @@ def dict_to_canon(dict):
 
 
 #Given a partition object from gerrymandr/RunDMCMC, outputs a tuple representing the district assignments
-#in canonical form
+#in canonical form. The sorted node ordering of the graph is cached (see graph_data.node_ordering), so only the
+#first partition of a graph pays for sorting its nodes
 def partition_to_canon(part):
-	G = nx.convert_node_labels_to_integers(part.graph, ordering = 'sorted', label_attribute = 'key')
-	ordered_assign = [part.assignment[G.nodes[node]['key']] for node in range(nx.number_of_nodes(G))]
-	return canonical_form(ordered_assign)
+	return canonical_form(node_ordering(part.graph).labels(part.assignment))
 
 
 #Given a chain object from gerrymandr/RunDMCMC, outputs a list of tuples, with the ith tuple being the district
 #assignments in canonical form at the ith step of that chain
+#Note: the whole chain is kept in memory, use iter_chain_canon or ensemble_format.save_chain_canon for long chains
 def chain_to_canon(chain):
-	out = list()
-	G = nx.convert_node_labels_to_integers(chain.state.graph, ordering = 'sorted', label_attribute = 'key')
+	return list(iter_chain_canon(chain))
+
+
+#Same as chain_to_canon, but yields each step as the chain produces it instead of building a list.
+#The cached sorted node ordering of the graph is used for the whole chain and each step's assignment is read
+#with a single itemgetter call. When chunk_size is given, steps are grouped into (chunk_size x num_nodes) arrays
+#canonicalized with canonical_array (the last chunk may be shorter)
+def iter_chain_canon(chain, chunk_size = None):
+	gather = node_ordering(chain.state.graph).gather
+	if chunk_size is None:
+		for part in chain:
+			yield canonical_form(gather(part.assignment))
+		return
+
+	chunk = list()
 	for part in chain:
-		ordered_assign = [part.assignment[G.nodes[node]['key']] for node in range(nx.number_of_nodes(G))]
-		out.append(canonical_form(ordered_assign))
-	return out
+		chunk.append(gather(part.assignment))
+		if len(chunk) == chunk_size:
+			yield canonical_array(chunk)
+			chunk = list()
+	if chunk:
+		yield canonical_array(chunk)
 
 
 #------------------------Partisan benchmarks -------------------------------
@@ -81,32 +163,108 @@ The graph should have relevant attributes for population, votes, etc depending o
 that benchmark, and nodes should be labeled according to their correspoding index in the assignments tuple
 If the graph needs to be relabeled, using nx.convert_node_lables_to_integers is advised
 Ex: G = nx.convert_node_labels_to_integers(graph, ordering = 'sorted', label_attribute = 'old_label')
+A graph_data.GraphData can be given instead of the graph, which skips reading the attributes node by node
+Ex: data = GraphData.from_networkx(graph)   or   GraphData.from_csv('demographic_data.csv', adjacency_path)
 
 Attribute names are assumed to be the following, but there are optional inputs for different names:
 Democrat votes: DV
 Republican votes: RV
+
+Every benchmark reads the vote attributes out of the graph once and sums them per district for the whole
+list of partitions at once with district_tallies. The *_from_tallies functions compute the scores from those
+totals, so several benchmarks can share one tally.
+Ex: dem_totals, rep_totals, num_dists = tally_votes(graph, partitions)
+	gaps = eff_gap_from_tallies(dem_totals, rep_totals, num_dists)
 '''
 
+#Takes a numeric node attribute out of graph as an array, with the value of node i at index i
+def node_attribute_array(graph, attr_name):
+	if isinstance(graph, GraphData):
+		return graph.attribute(attr_name)
+	return np.array([graph.nodes[node][attr_name] for node in range(nx.number_of_nodes(graph))], dtype = float)
+
+
+#Democrat and republican votes of every node as two arrays
+def vote_arrays(graph, dv_name = 'DV', rv_name = 'RV'):
+	return node_attribute_array(graph, dv_name), node_attribute_array(graph, rv_name)
+
+
+#Sums per-node weights (votes, population...) over the districts of every partition in a batch.
+#partitions is a list of canonical form tuples or a (num_partitions x num_nodes) array, weights is a single array
+#of per-node values or a list of them. Each weight takes one bincount over the whole batch, whose temporaries are
+#(num_partitions x num_nodes) arrays; callers with large batches pass them in chunks of chunk_rows(num_nodes)
+#partitions.
+#Outputs an array of shape (num_weights x num_partitions x num_dists) where [w, p, d-1] is the total of weight w
+#in district d of partition p. Partitions with less than num_dists districts get zero totals for the missing ones
+#Ex: district_tallies([(1,1,2),(1,2,2)], [1,2,3]) = array([[[3,3],[1,5]]])
+def district_tallies(partitions, weights, num_dists = None):
+	partitions = np.asarray(partitions)
+	if partitions.ndim == 1:
+		partitions = partitions[np.newaxis]
+	weights = np.asarray(weights, dtype = float)
+	if weights.ndim == 1:
+		weights = weights[np.newaxis]
+	num_parts = len(partitions)
+	if num_dists is None:
+		num_dists = int(partitions.max()) if partitions.size else 0
+
+	#node n of partition p goes in bin p*num_dists + (district - 1)
+	bins = (np.arange(num_parts)[:, np.newaxis] * num_dists + partitions.astype(np.intp) - 1).ravel()
+	tallies = np.empty((len(weights), num_parts * num_dists))
+	for w in range(len(weights)):
+		node_weights = np.broadcast_to(weights[w], partitions.shape).ravel()
+		tallies[w] = np.bincount(bins, weights = node_weights, minlength = num_parts * num_dists)
+	return tallies.reshape(len(weights), num_parts, num_dists)
+
+
+#Per-district democrat and republican vote totals of every partition, along with the number of districts
+#in each partition. This is the shared input of the *_from_tallies functions. Partitions are tallied in chunks
+#(see chunk_rows), so anything plan_chunks accepts can be given
+def tally_votes(graph, partitions, dv_name = 'DV', rv_name = 'RV'):
+	votes = vote_arrays(graph, dv_name, rv_name)
+	tallies = list()
+	num_dists = list()
+	for chunk in plan_chunks(partitions, chunk_rows(len(votes[0]))):
+		tallies.append(district_tallies(chunk, votes))
+		num_dists.append(chunk.max(axis = 1))
+	if not tallies:
+		return np.zeros((0, 0)), np.zeros((0, 0)), np.zeros(0, dtype = np.intp)
+	#chunks with fewer districts get zero totals for the missing ones, as district_tallies gives
+	width = max(chunk_tallies.shape[2] for chunk_tallies in tallies)
+	tallies = np.concatenate([np.pad(chunk_tallies, ((0, 0), (0, 0), (0, width - chunk_tallies.shape[2])))
+							for chunk_tallies in tallies], axis = 1)
+	return tallies[0], tallies[1], np.concatenate(num_dists)
+
+
+#Boolean array marking the districts that exist in each partition, which is all of them unless partitions
+#with different numbers of districts were tallied together
+def district_mask(totals, num_dists):
+	return np.arange(totals.shape[1]) < np.asarray(num_dists)[:, np.newaxis]
+
+
+#Democrat vote share of every district, nan for districts a partition doesn't have
+def dem_vote_shares(dem_totals, rep_totals, num_dists):
+	with np.errstate(invalid = 'ignore', divide = 'ignore'):
+		shares = dem_totals / (dem_totals + rep_totals)
+	shares[~district_mask(dem_totals, num_dists)] = np.nan
+	return shares
+
+
 #efficiency gap calculator
 #requires votes by vtd for each party
 #Note: wastage is calculated as democratic waste - republican waste, so a republican favoring plan
 #results in a positive efficiency gap, and a democratic favoring plan results in a negative
 def eff_gap(graph, partitions, dv_name = 'DV', rv_name = 'RV'):
-	output = list()
-	for part in partitions:
-		num_dists = len(set(part))
-		wasted_sum = 0
-		dem_votes = [0]*num_dists
-		rep_votes = [0]*num_dists
-		for node in graph.nodes:
-			dem_votes[part[node]-1] += graph.nodes[node][dv_name]
-			rep_votes[part[node]-1] += graph.nodes[node][rv_name]
-		for dist in range(num_dists):
-			dv_wasted, rv_wasted = wasted_votes(dem_votes[dist], rep_votes[dist])
-			wasted_sum += dv_wasted - rv_wasted
-		total_votes = sum(dem_votes) + sum(rep_votes)
-		output.append(wasted_sum / total_votes)
-	return output
+	return eff_gap_from_tallies(*tally_votes(graph, partitions, dv_name, rv_name)).tolist()
+
+
+#same rule as wasted_votes applied to every district at once, missing districts have no votes to waste
+def eff_gap_from_tallies(dem_totals, rep_totals, num_dists):
+	half_votes = (dem_totals + rep_totals) / 2
+	dem_won = dem_totals > rep_totals
+	dem_waste = np.where(dem_won, dem_totals - half_votes, dem_totals)
+	rep_waste = np.where(dem_won, rep_totals, rep_totals - half_votes)
+	return (dem_waste - rep_waste).sum(axis = 1) / (2 * half_votes.sum(axis = 1))
 
 
 def wasted_votes(party1_votes, party2_votes):
@@ -124,22 +282,20 @@ def wasted_votes(party1_votes, party2_votes):
 #ties are counted as half a seat
 #requires votes by vtd for each party
 def dem_seats(graph, partitions, dv_name = 'DV', rv_name = 'RV'):
-	output = list()
-	for part in partitions:
-		num_dists = len(set(part))
-		dem_votes = [0]*num_dists
-		rep_votes = [0]*num_dists
-		for node in graph.nodes:
-			dem_votes[part[node]-1] += graph.nodes[node][dv_name]
-			rep_votes[part[node]-1] += graph.nodes[node][rv_name]
-		output.append(sum([1 if dem_votes[dist] > rep_votes[dist] else 0 if 
-			rep_votes[dist] > dem_votes[dist] else .5 for dist in range(num_dists)]))
-	return output
+	return dem_seats_from_tallies(*tally_votes(graph, partitions, dv_name, rv_name)).tolist()
+
+
+def dem_seats_from_tallies(dem_totals, rep_totals, num_dists):
+	seats = np.where(dem_totals > rep_totals, 1.0, np.where(rep_totals > dem_totals, 0.0, 0.5))
+	return np.where(district_mask(dem_totals, num_dists), seats, 0).sum(axis = 1)
 
 
 def rep_seats(graph, partitions, dv_name = 'DV', rv_name = 'RV'):
-	dem_seats_list = dem_seats(graph, partitions, dv_name, rv_name)
-	return [len(set(partitions[x])) - dem_seats_list[x] for x in range(len(partitions))]
+	return rep_seats_from_tallies(*tally_votes(graph, partitions, dv_name, rv_name)).tolist()
+
+
+def rep_seats_from_tallies(dem_totals, rep_totals, num_dists):
+	return num_dists - dem_seats_from_tallies(dem_totals, rep_totals, num_dists)
 
 
 #mean median score for democrats
@@ -150,35 +306,281 @@ def rep_seats(graph, partitions, dv_name = 'DV', rv_name = 'RV'):
 #voter attribute as dv_name and the democrat one as rv_name
 #This measure is less robust in cases where one party is heavily favored
 def mean_median(graph, partitions, dv_name = 'DV', rv_name = 'RV'):
-	output = list()
-	for part in partitions:
-		num_dists = len(set(part))
-		dem_totals = [0]*num_dists
-		rep_totals = [0]*num_dists
-		for node in graph.nodes:
-			dem_totals[part[node]-1] += graph.nodes[node][dv_name]
-			rep_totals[part[node]-1] += graph.nodes[node][rv_name]
-		dem_vote_percents = [1.0 * dem_totals[x] / (dem_totals[x] + rep_totals[x]) for x in range(num_dists)]
-		output.append(np.mean(dem_vote_percents) - np.median(dem_vote_percents))
-	return output
+	return mean_median_from_tallies(*tally_votes(graph, partitions, dv_name, rv_name)).tolist()
+
+
+def mean_median_from_tallies(dem_totals, rep_totals, num_dists):
+	shares = dem_vote_shares(dem_totals, rep_totals, num_dists)
+	if np.all(np.asarray(num_dists) == shares.shape[1]):
+		return np.mean(shares, axis = 1) - np.median(shares, axis = 1)
+	return np.nanmean(shares, axis = 1) - np.nanmedian(shares, axis = 1)
 
 
 #mean thirdian score for democrats
 #requires votes by vtd for each party
 def mean_thirdian(graph, partitions, dv_name = 'DV', rv_name = 'RV'):
-	output = list()
-	for part in partitions:
-		num_dists = len(set(part))
-		dem_totals = [0]*num_dists
-		rep_totals = [0]*num_dists
-		for node in graph.nodes:
-			dem_totals[part[node]-1] += graph.nodes[node][dv_name]
-			rep_totals[part[node]-1] += graph.nodes[node][rv_name]
-		dem_vote_percents = [1.0 * dem_totals[x] / (dem_totals[x] + rep_totals[x]) for x in range(num_dists)]
-		thirdian_index = round((len(dem_vote_percents)) / 3)
-		thirdian = sorted(dem_vote_percents)[thirdian_index]
-		output.append(np.mean(dem_vote_percents) - thirdian)
-	return output
+	return mean_thirdian_from_tallies(*tally_votes(graph, partitions, dv_name, rv_name)).tolist()
+
+
+def mean_thirdian_from_tallies(dem_totals, rep_totals, num_dists):
+	shares = dem_vote_shares(dem_totals, rep_totals, num_dists)
+	#missing districts are nan, which sorts after every real vote share
+	thirdian_index = np.round(np.asarray(num_dists) / 3).astype(np.intp)
+	thirdian = np.take_along_axis(np.sort(shares, axis = 1), thirdian_index[:, np.newaxis], axis = 1)[:, 0]
+	return np.nanmean(shares, axis = 1) - thirdian
+
+
+#------------------------Scoring whole ensembles -------------------------------
+#score_ensemble computes any combination of the benchmarks above, plus the partition entropy and seat share
+#used as features in plots/utils.py, with one pass over the partitions. Each chunk of partitions is tallied
+#once and every requested score is derived from that tally.
+#It outputs a structured array with one field per metric, index-paired with the partitions
+#Ex: scores = score_ensemble(graph, partitions, metrics = ['eff_gap', 'mean_median'])
+#	scores['eff_gap'][5] = efficiency gap of the 6th partition
+
+
+#entropy of the district sizes, same as entropy in plots/utils.py: -sum(size*log(size)) over districts
+def entropy_from_tallies(node_counts, num_dists):
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		terms = np.where(node_counts > 0, node_counts * np.log(node_counts), 0)
+	return -terms.sum(axis = 1)
+
+
+#democrat seats as counted by get_dem_seat_share in plots/utils.py, where only a district with no votes at all
+#counts as half a seat (dem_seats counts every tie as half)
+def seat_share_from_tallies(dem_totals, rep_totals, num_dists):
+	seats = np.where(dem_totals > rep_totals, 1.0, np.where((dem_totals == 0) & (rep_totals == 0), 0.5, 0.0))
+	return np.where(district_mask(dem_totals, num_dists), seats, 0).sum(axis = 1)
+
+
+#metrics score_ensemble knows, each computed from (dem_totals, rep_totals, node_counts, num_dists)
+ENSEMBLE_METRICS = {
+	'eff_gap' : lambda dem, rep, size, k: eff_gap_from_tallies(dem, rep, k),
+	'dem_seats' : lambda dem, rep, size, k: dem_seats_from_tallies(dem, rep, k),
+	'rep_seats' : lambda dem, rep, size, k: rep_seats_from_tallies(dem, rep, k),
+	'mean_median' : lambda dem, rep, size, k: mean_median_from_tallies(dem, rep, k),
+	'mean_thirdian' : lambda dem, rep, size, k: mean_thirdian_from_tallies(dem, rep, k),
+	'entropy' : lambda dem, rep, size, k: entropy_from_tallies(size, k),
+	'seat_share' : lambda dem, rep, size, k: seat_share_from_tallies(dem, rep, k),
+}
+
+
+#number of array elements a chunk of partitions is sized to, which bounds the temporaries of one pass over a chunk
+#(2**22 intp elements take 32 MB), see chunk_rows
+CHUNK_ELEMENTS = 2**22
+
+
+#Number of partitions in a chunk whose temporaries take elements_per_partition elements for each partition (the
+#number of nodes for a tally), so a chunk stays within CHUNK_ELEMENTS whatever the size of the graph
+def chunk_rows(elements_per_partition):
+	return max(1, CHUNK_ELEMENTS // max(1, int(elements_per_partition)))
+
+
+#Splits partitions into (chunk_size x num_nodes) arrays. partitions can be an array, a list of tuples, or any
+#iterable of plans (such as a generator over a chain); iterables that already yield 2-D arrays are passed through
+def plan_chunks(partitions, chunk_size = 100000):
+	if isinstance(partitions, np.ndarray) and partitions.ndim == 2:
+		for start in range(0, len(partitions), chunk_size):
+			yield partitions[start:start + chunk_size]
+		return
+	chunk = list()
+	for plan in partitions:
+		if isinstance(plan, np.ndarray) and plan.ndim == 2:
+			if chunk:
+				yield np.array(chunk)
+				chunk = list()
+			yield plan
+			continue
+		chunk.append(plan)
+		if len(chunk) == chunk_size:
+			yield np.array(chunk)
+			chunk = list()
+	if chunk:
+		yield np.array(chunk)
+
+
+#Scores partitions against per-node vote arrays, see score_ensemble. chunk_size is the number of partitions
+#tallied at once, by default chunk_rows of the number of nodes
+def score_partitions(partitions, dem_votes, rep_votes, metrics = tuple(ENSEMBLE_METRICS), chunk_size = None):
+	unknown = [metric for metric in metrics if metric not in ENSEMBLE_METRICS]
+	if unknown:
+		raise ValueError('unknown metrics: ' + ', '.join(unknown))
+	weights = np.array([dem_votes, rep_votes, np.ones(len(dem_votes))], dtype = float)
+	if chunk_size is None:
+		chunk_size = chunk_rows(len(dem_votes))
+
+	columns = {metric : list() for metric in metrics}
+	for chunk in plan_chunks(partitions, chunk_size):
+		dem_totals, rep_totals, node_counts = district_tallies(chunk, weights)
+		num_dists = chunk.max(axis = 1)
+		for metric in metrics:
+			columns[metric].append(ENSEMBLE_METRICS[metric](dem_totals, rep_totals, node_counts, num_dists))
+
+	num_parts = sum(len(column) for column in columns[metrics[0]]) if metrics else 0
+	scores = np.empty(num_parts, dtype = [(metric, float) for metric in metrics])
+	for metric in metrics:
+		if num_parts:
+			scores[metric] = np.concatenate(columns[metric])
+	return scores
+
+
+#Computes every benchmark in metrics for each partition in a single pass. Metric names are the keys of
+#ENSEMBLE_METRICS: eff_gap, dem_seats, rep_seats, mean_median, mean_thirdian, entropy and seat_share.
+#partitions is anything plan_chunks accepts and is only iterated once
+def score_ensemble(graph, partitions, metrics = tuple(ENSEMBLE_METRICS), dv_name = 'DV', rv_name = 'RV',
+					chunk_size = None):
+	dem_votes, rep_votes = vote_arrays(graph, dv_name, rv_name)
+	return score_partitions(partitions, dem_votes, rep_votes, metrics, chunk_size)
+
+
+#------------------------Scoring chains -------------------------------
+#Consecutive steps of a flip chain only differ in the flipped nodes, so ChainScorer keeps the per-district
+#vote, node count and (optionally) population totals of the current plan and only moves the flipped nodes'
+#weights between the districts involved. Totals are recorded for every step and turned into scores in batches
+#with the same functions score_ensemble uses. Districts are assumed not to vanish, as in RunDMCMC chains.
+#Canonical form relabels every district whenever a flip changes which district appears first, so plans are
+#compared in a labeling kept consistent along the chain (chain_moves): each step's districts are matched to the
+#previous step's and only nodes that changed district count as moved.
+
+
+#sigma[s, b] is the district of old[s] that district b of new[s] continues, taken as the district it overlaps
+#most (old and new are (steps x num_nodes) arrays of labels 1 to num_dists, column 0 of sigma is unused). When
+#that isn't one to one (for example a flip leaves two districts tied) the matching with the most overlap is
+#solved for that step instead
+def match_districts(old, new, num_dists):
+	size = num_dists + 1
+	keys = (np.arange(len(old))[:, np.newaxis] * size + old) * size + new
+	overlap = np.bincount(keys.ravel(), minlength = len(old) * size * size).reshape(len(old), size, size)
+	sigma = overlap.argmax(axis = 1)
+	sigma[:, 0] = 0
+	bad = np.flatnonzero((np.sort(sigma[:, 1:], axis = 1) != np.arange(1, size)).any(axis = 1))
+	for step in bad:
+		rows, cols = optimize.linear_sum_assignment(-overlap[step, 1:, 1:])
+		sigma[step, cols + 1] = rows + 1
+	return sigma
+
+
+#Nodes moved between consecutive plans of a chain. previous is the plan before plans (an array of labels 1 to
+#num_dists) and labels[l] is the consistent district of its label l (labels[0] unused). Outputs
+#(steps, nodes, old_districts, new_districts, labels): the step and node of every move, the consistent districts
+#the node leaves and enters, and the labels of the last plan, to be passed in with the next chunk
+def chain_moves(previous, plans, labels):
+	previous_plans = np.vstack([previous[np.newaxis], plans[:-1]])
+	moved = np.flatnonzero((plans != previous_plans).any(axis = 1))
+	if len(moved) == 0:
+		empty = np.zeros(0, dtype = np.intp)
+		return empty, empty, empty, empty, labels
+	old, new = previous_plans[moved], plans[moved]
+	sigma = match_districts(old, new, len(labels) - 1)
+	#labels of each moved step's previous plan, which only change at steps that relabel
+	relabeled = np.flatnonzero((sigma != np.arange(len(labels))).any(axis = 1))
+	perms = np.empty((len(relabeled) + 1, len(labels)), dtype = np.intp)
+	perms[0] = labels
+	for i, step in enumerate(relabeled):
+		perms[i + 1] = perms[i][sigma[step]]
+	before = perms[np.searchsorted(relabeled, np.arange(len(moved)), side = 'left')]
+	#a node moved if its district in the previous step isn't the match of its new one
+	steps, nodes = np.nonzero(old != np.take_along_axis(sigma, new, axis = 1))
+	old_districts = before[steps, old[steps, nodes]]
+	new_districts = before[steps, sigma[steps, new[steps, nodes]]]
+	return moved[steps], nodes, old_districts, new_districts, perms[-1].copy()
+
+
+#Ex: scorer = ChainScorer(graph, plans[0])
+#	scorer.advance(plans)                        #consecutive canonical plans, e.g. from chain_to_canon
+#	scorer.flip(node, district)                  #or record single moves one at a time
+#	scores = scorer.scores(['eff_gap', 'mean_median'])
+class ChainScorer:
+
+	def __init__(self, graph, initial_partition, dv_name = 'DV', rv_name = 'RV', pop_name = None):
+		weights = list(vote_arrays(graph, dv_name, rv_name)) + [np.ones(nx.number_of_nodes(graph))]
+		if pop_name is not None:
+			weights.append(node_attribute_array(graph, pop_name))
+		self.weights = np.array(weights)
+		self.assignment = np.array(initial_partition, dtype = np.intp)
+		self.num_dists = int(self.assignment.max())
+		#last plan given to advance and the district of each of its labels (see chain_moves). flip only drops
+		#previous, which advance sets back to the assignment before its first chunk, so flips stay O(moved nodes)
+		self.previous = self.assignment.copy()
+		self.labels = np.arange(self.num_dists + 1)
+		#totals[d-1, w] is the total of weight w (DV, RV, node count, population) in district d
+		self.totals = district_tallies(self.assignment, self.weights, self.num_dists)[:, 0, :].T.copy()
+		self.history = list()
+
+	#population of each district in the current plan, needs pop_name
+	def populations(self):
+		return self.totals[:, 3].copy()
+
+	#Moves nodes (one node or a list of them for a chunk flip) into district and records the result as a step.
+	#Only the totals of the districts the nodes leave and enter are touched
+	def flip(self, nodes, district):
+		nodes = np.atleast_1d(nodes)
+		moved = self.weights[:, nodes].T
+		np.subtract.at(self.totals, self.assignment[nodes] - 1, moved)
+		self.totals[district - 1] += moved.sum(axis = 0)
+		self.assignment[nodes] = district
+		self.previous = None
+		self.history.append(self.totals[np.newaxis].copy())
+
+	#Records the current plan again, for steps where the chain stays put
+	def stay(self):
+		self.history.append(self.totals[np.newaxis].copy())
+
+	#Advances through consecutive plans of the chain (canonical or not) and records one step per plan. Only nodes
+	#that changed district since the step before move weight (see chain_moves), and the moves of a whole chunk
+	#are applied with a cumulative sum instead of step by step
+	def advance(self, partitions, chunk_size = None):
+		if chunk_size is None:
+			chunk_size = chunk_rows(len(self.assignment))
+		if self.previous is None:
+			self.previous = self.assignment.copy()
+			self.labels = np.arange(self.num_dists + 1)
+		for chunk in plan_chunks(partitions, chunk_size):
+			chunk = np.asarray(chunk, dtype = np.intp)
+			if chunk.max() > self.num_dists:
+				raise ValueError('chain has more districts than its first plan')
+			steps, nodes, old, new, self.labels = chain_moves(self.previous, chunk, self.labels)
+			moved = self.weights[:, nodes].T
+			deltas = np.zeros((len(chunk),) + self.totals.shape)
+			np.add.at(deltas, (steps, new - 1), moved)
+			np.subtract.at(deltas, (steps, old - 1), moved)
+			block = self.totals + np.cumsum(deltas, axis = 0)
+			self.history.append(block)
+			self.totals = block[-1].copy()
+			self.previous = chunk[-1].copy()
+			self.assignment = self.labels[self.previous]
+
+	#Scores of every step recorded since the last call, as a structured array like score_ensemble's.
+	#Recorded totals are dropped afterwards so long chains can be scored a piece at a time
+	def scores(self, metrics = tuple(ENSEMBLE_METRICS)):
+		unknown = [metric for metric in metrics if metric not in ENSEMBLE_METRICS]
+		if unknown:
+			raise ValueError('unknown metrics: ' + ', '.join(unknown))
+		totals = np.concatenate(self.history) if self.history else np.zeros((0,) + self.totals.shape)
+		self.history = list()
+		num_dists = np.full(len(totals), self.num_dists)
+		scores = np.empty(len(totals), dtype = [(metric, float) for metric in metrics])
+		for metric in metrics:
+			scores[metric] = ENSEMBLE_METRICS[metric](totals[:, :, 0], totals[:, :, 1], totals[:, :, 2], num_dists)
+		return scores
+
+
+#Scores every step of a chain given as consecutive plans with a ChainScorer, giving the same output as
+#score_ensemble on the same plans
+def score_chain(graph, partitions, metrics = tuple(ENSEMBLE_METRICS), dv_name = 'DV', rv_name = 'RV',
+				chunk_size = None):
+	if chunk_size is None:
+		chunk_size = chunk_rows(nx.number_of_nodes(graph))
+	scorer = None
+	scores = list()
+	for chunk in plan_chunks(partitions, chunk_size):
+		if scorer is None:
+			scorer = ChainScorer(graph, chunk[0], dv_name, rv_name)
+		scorer.advance(chunk)
+		scores.append(scorer.scores(metrics))
+	if not scores:
+		return np.empty(0, dtype = [(metric, float) for metric in metrics])
+	return np.concatenate(scores)
 
 
 #----------------------------Distance calculations--------------------------------------
@@ -194,35 +596,283 @@ def mean_thirdian(graph, partitions, dv_name = 'DV', rv_name = 'RV'):
 #and elements of the tuples are index-paired to the towers.
 #ex: hamming_dist(graph, partitions, towers)[5][4] = the distance between the 6th element of
 #partitions and the 5th element of towers. 
+#Computed in batches by hamming_distances, which outputs the same distances as an array
 def hamming_dist(graph, partitions, towers):
-	output = list()
-	towers = [{node : towers[x][node] for node in graph.nodes} for x in range(len(towers))]
-	for part in partitions:
-		part = {node : part[node] for node in graph.nodes}
-		output.append(tuple([unlabeled_hamming_distance(graph, part, towers[x]) for x in range(len(towers))]))
-	return output
+	return [tuple(row) for row in hamming_distances(graph, partitions, towers).tolist()]
 
 
 #same as hamming_dist but for entropy distances
+#Computed in batches by entropy_distances
 def entropy_dist(graph, partitions, towers):
-	output = list()
-	towers = [{node : towers[x][node] for node in graph.nodes} for x in range(len(towers))]
-	for part in partitions:
-		part = {node : part[node] for node in graph.nodes}
-		output.append(tuple([entropy_distance(graph, part, towers[x]) for x in range(len(towers))]))
-	return output
-
-
-#This function uses code from the gerrymandr/spanning_trees repository. Uncomment and put a 
-#file path to your local copy of the repository to use
-'''
-sys.path.append('file_path_to/spanning_trees')
-from spanning_trees.main import explore_random
+	return [tuple(row) for row in entropy_distances(graph, partitions, towers).tolist()]
+
+
+#------------------------Batched distances -------------------------------
+#The unlabeled hamming and entropy distances only depend on how many nodes each district of a partition shares
+#with each district of a tower, so both are computed from a (num_dists x num_dists) contingency table per (partition, tower) pair.
+#Tables for a whole batch come from one bincount over packed label pairs, and the best matchings of districts
+#for all of them are solved together.
+#Ex: distances = hamming_distances(plans, towers)     #(num_plans x num_towers) array
+#	distances[5, 4] = the distance between the 6th plan and the 5th tower
+
+#largest number of districts for which matchings are found by trying every permutation at once
+MAX_ENUMERATED_DISTS = 6
+
+
+#Outputs the (num_partitions x num_towers x num_dists x num_dists) array of overlaps where
+#tables[p, t, i, j] is the number of nodes in district i+1 of partitions[p] and district j+1 of towers[t].
+#Both inputs are 2-D arrays (or lists) of plans with labels 1 to num_dists, such as canonical form plans.
+#Towers are counted one at a time, so the temporaries are (num_partitions x num_nodes) key arrays
+def contingency_tables(partitions, towers, num_dists = None):
+	partitions = np.asarray(partitions, dtype = np.intp)
+	towers = np.asarray(towers, dtype = np.intp)
+	if num_dists is None:
+		num_dists = int(max(partitions.max(initial = 1), towers.max(initial = 1)))
+	num_cells = len(partitions) * num_dists * num_dists
+	#node n of partition p goes in cell p*num_dists^2 + (district - 1)*num_dists + (tower district - 1)
+	partition_keys = (partitions - 1) * num_dists + (np.arange(len(partitions)) * num_dists * num_dists)[:, np.newaxis]
+	tables = np.empty((len(partitions), len(towers), num_dists, num_dists), dtype = np.intp)
+	for t in range(len(towers)):
+		keys = partition_keys + (towers[t] - 1)
+		tables[:, t] = np.bincount(keys.ravel(), minlength = num_cells).reshape(len(partitions), num_dists, num_dists)
+	return tables
+
+
+#Finds the matching of rows to columns with the largest total for every table in an (... x k x k) array. Outputs
+#(values, matchings) where values[...] is the matched total and matchings[..., i] is the column matched to row i.
+#Up to MAX_ENUMERATED_DISTS districts every permutation is scored at once, beyond that each table is solved
+#with the Hungarian algorithm
+def max_weight_matchings(tables):
+	tables = np.asarray(tables)
+	shape, size = tables.shape[:-2], tables.shape[-1]
+	flat = tables.reshape(-1, size, size)
+	values = np.empty(len(flat), dtype = tables.dtype)
+	matchings = np.empty((len(flat), size), dtype = np.intp)
+	if size <= MAX_ENUMERATED_DISTS:
+		perms = np.array(list(itertools.permutations(range(size))), dtype = np.intp).reshape(-1, size)
+		rows = np.arange(size)
+		#each block gathers a (block x permutations x size) temporary, kept within CHUNK_ELEMENTS (at k = 6 that is
+		#720 permutations x 6 entries per table)
+		block = max(1, CHUNK_ELEMENTS // (len(perms) * size))
+		for start in range(0, len(flat), block):
+			totals = flat[start:start + block][:, rows, perms].sum(axis = -1)
+			best = totals.argmax(axis = 1)
+			values[start:start + block] = totals[np.arange(len(best)), best]
+			matchings[start:start + block] = perms[best]
+	else:
+		for i, table in enumerate(flat):
+			rows, cols = optimize.linear_sum_assignment(table, maximize = True)
+			values[i] = table[rows, cols].sum()
+			matchings[i] = cols
+	return values.reshape(shape), matchings.reshape(shape + (size,))
+
+
+#Columns of partitions in the order of graph.nodes, or all of them in order for no graph or a GraphData (whose
+#nodes are numbered by position already)
+def node_columns(graph):
+	return slice(None) if graph is None or isinstance(graph, GraphData) else list(graph.nodes)
+
+
+#Number of partitions per chunk of the tower distance functions: a chunk's key arrays take num_nodes elements
+#per partition and its tables num_towers * num_dists^2
+def tower_chunk_rows(towers):
+	towers = np.asarray(towers)
+	num_dists = int(towers.max(initial = 1))
+	return chunk_rows(towers.shape[-1] + len(towers) * num_dists * num_dists)
+
+
+#Yields (chunk, tables) for chunks of partitions, where tables are the contingency tables of the chunk against
+#every tower. Columns are taken in the order of graph.nodes, like hamming_dist. chunk_size defaults to
+#tower_chunk_rows
+def iter_contingency_tables(graph, partitions, towers, chunk_size = None):
+	nodes = node_columns(graph)
+	towers = canonical_array(np.asarray(towers)[:, nodes])
+	if chunk_size is None:
+		chunk_size = tower_chunk_rows(towers)
+	for chunk in plan_chunks(partitions, chunk_size):
+		chunk = canonical_array(chunk[:, nodes])
+		num_dists = int(max(chunk.max(), towers.max()))
+		yield chunk, contingency_tables(chunk, towers, num_dists)
+
+
+#Entropy distance of partition_entropy for every table in an (... x k x k) array of contingency tables, with
+#rows for the districts of the partitions and columns for the districts of the towers
+def entropy_from_tables(tables):
+	tables = np.asarray(tables, dtype = float)
+	row_sums = tables.sum(axis = -1, keepdims = True)
+	col_sums = tables.sum(axis = -2, keepdims = True)
+	with np.errstate(invalid = 'ignore', divide = 'ignore'):
+		proportions = tables / col_sums
+		terms = np.where(tables > 0, row_sums * proportions * np.log(proportions), 0)
+	return -terms.sum(axis = (-2, -1)) / tables.sum(axis = (-2, -1))
+
+
+#Distances between every partition and every tower from a single pass over the partitions, output as
+#(hamming, entropy) (num_partitions x num_towers) arrays, with None for a distance that isn't asked for.
+#partitions is anything plan_chunks accepts, so long chains can be streamed chunk_size steps at a time (by
+#default tower_chunk_rows). graph can be None when plans are already indexed by node
+def tower_distances(graph, partitions, towers, hamming = True, entropy = True, chunk_size = None):
+	hamming_output = list()
+	entropy_output = list()
+	for chunk, tables in iter_contingency_tables(graph, partitions, towers, chunk_size):
+		if hamming:
+			hamming_output.append(chunk.shape[1] - max_weight_matchings(tables)[0])
+		if entropy:
+			entropy_output.append(entropy_from_tables(tables))
+	empty = np.zeros((0, len(towers)))
+	hamming_output = np.concatenate(hamming_output) if hamming_output else empty.astype(np.intp)
+	entropy_output = np.concatenate(entropy_output) if entropy_output else empty
+	return (hamming_output if hamming else None, entropy_output if entropy else None)
+
+
+#Unlabeled hamming distance (number of nodes minus the best overlap over matchings of districts) between every
+#partition and every tower, as a (num_partitions x num_towers) integer array
+def hamming_distances(graph, partitions, towers, chunk_size = None):
+	return tower_distances(graph, partitions, towers, entropy = False, chunk_size = chunk_size)[0]
+
+
+#Entropy distance (see partition_entropy) between every partition and every tower, as a
+#(num_partitions x num_towers) array
+def entropy_distances(graph, partitions, towers, chunk_size = None):
+	return tower_distances(graph, partitions, towers, hamming = False, chunk_size = chunk_size)[1]
+
+
+#------------------------Tracking towers along chains -------------------------------
+#A flip moves a node between two districts of the chain's plan, which changes one row of each tower's contingency
+#table by -1 and another by +1. TowerTracker keeps the tables and the best matching of districts for every tower
+#and updates the tables with the moves of each step. Any matching's total changes by at most the number of moved
+#nodes, and no matching can beat the sum of row maxima or of column maxima, so the current matching is kept
+#whenever its new total reaches one of those bounds, and the assignment is only solved again for the
+#(step, tower) pairs it can't prove. Entropy distances are read off the tables directly.
+#Ex: tracker = TowerTracker(graph, plans[0], towers)
+#	tracker.advance(plans)                       #consecutive canonical plans, e.g. from chain_to_canon
+#	tracker.flip(node, district)                 #or record single moves one at a time
+#	hamming, entropy = tracker.distances()
+class TowerTracker:
+
+	def __init__(self, graph, initial_partition, towers, hamming = True, entropy = True):
+		self.nodes = node_columns(graph)
+		self.towers = canonical_array(np.asarray(towers)[:, self.nodes]).astype(np.intp)
+		self.assignment = np.asarray(initial_partition, dtype = np.intp)[self.nodes]
+		self.num_dists = int(max(self.assignment.max(), self.towers.max()))
+		self.hamming = hamming
+		self.entropy = entropy
+		self.tables = contingency_tables(self.assignment[np.newaxis], self.towers, self.num_dists)[0]
+		self.values, self.matchings = max_weight_matchings(self.tables)
+		#last plan given to advance and the district of each of its labels (see chain_moves). flip only drops
+		#previous, which advance sets back to the assignment before its first chunk, so flips stay O(moved nodes)
+		self.previous = self.assignment.copy()
+		self.labels = np.arange(self.num_dists + 1)
+		#number of (step, tower) assignments solved again because the bounds couldn't keep the matching
+		self.solves = 0
+		self.history = list()
+
+	#Moves nodes (one node or a list of them for a chunk flip) into district and records the result as a step
+	def flip(self, nodes, district):
+		nodes = np.unique(nodes)
+		nodes = nodes[self.assignment[nodes] != district]
+		tables = self.tables.copy()
+		tower_labels = self.towers[:, nodes] - 1
+		towers = np.arange(len(self.towers))[:, np.newaxis]
+		np.subtract.at(tables, (towers, self.assignment[nodes] - 1, tower_labels), 1)
+		np.add.at(tables, (towers, district - 1, tower_labels), 1)
+		self.assignment[nodes] = district
+		self.previous = None
+		self.record(tables[np.newaxis], np.array([len(nodes)]))
+
+	#Records the current plan again, for steps where the chain stays put
+	def stay(self):
+		self.record(self.tables[np.newaxis], np.zeros(1, dtype = np.intp))
+
+	#Advances through consecutive plans of the chain (canonical or not) and records one step per plan. Only nodes
+	#that changed district since the step before are moved (see chain_moves). The moves of a whole chunk are
+	#applied to the tables with a cumulative sum, which takes (chunk_size x towers x num_dists^2) memory, so
+	#chunk_size defaults to tower_chunk_rows
+	def advance(self, partitions, chunk_size = None):
+		if chunk_size is None:
+			chunk_size = tower_chunk_rows(self.towers)
+		if self.previous is None:
+			self.previous = self.assignment.copy()
+			self.labels = np.arange(self.num_dists + 1)
+		towers = np.arange(len(self.towers))
+		for chunk in plan_chunks(partitions, chunk_size):
+			chunk = np.asarray(chunk, dtype = np.intp)[:, self.nodes]
+			if chunk.max() > self.num_dists:
+				raise ValueError('chain has more districts than its first plan and towers')
+			steps, nodes, old, new, self.labels = chain_moves(self.previous, chunk, self.labels)
+			tower_labels = self.towers[:, nodes].T - 1
+			deltas = np.zeros((len(chunk),) + self.tables.shape, dtype = self.tables.dtype)
+			np.add.at(deltas, (steps[:, np.newaxis], towers, new[:, np.newaxis] - 1, tower_labels), 1)
+			np.subtract.at(deltas, (steps[:, np.newaxis], towers, old[:, np.newaxis] - 1, tower_labels), 1)
+			self.record(self.tables + np.cumsum(deltas, axis = 0), np.bincount(steps, minlength = len(chunk)))
+			self.previous = chunk[-1].copy()
+			self.assignment = self.labels[self.previous]
+
+	#Records the distances of consecutive steps given their (steps x towers x num_dists x num_dists) tables and
+	#the number of nodes moved at each step. Steps are checked a window at a time against the matching that was
+	#optimal at the end of the previous window, and a step's matching is optimal if its total reaches the row or
+	#column bound, or if it gained at least as much as the number of moved nodes since a step where it was optimal
+	def record(self, tables, moves, window = 32):
+		num_towers = tables.shape[1]
+		tower_index = np.arange(num_towers)[:, np.newaxis]
+		hamming = list()
+		for start in range(0, len(tables), window):
+			block = tables[start:start + window]
+			block_moves = moves[start:start + window]
+			step_index = np.arange(len(block))[:, np.newaxis]
+			values = block[:, tower_index, np.arange(self.num_dists), self.matchings].sum(axis = -1)
+			upper = np.minimum(block.max(axis = -1).sum(axis = -1), block.max(axis = -2).sum(axis = -1))
+			gained = np.diff(np.vstack([self.values[np.newaxis], values]), axis = 0) >= block_moves[:, np.newaxis]
+			last_bound = np.maximum.accumulate(np.where(values >= upper, step_index, -1), axis = 0)
+			last_loss = np.maximum.accumulate(np.where(gained, -1, step_index), axis = 0)
+			unproven_steps, unproven_towers = np.nonzero(last_bound < last_loss)
+			if len(unproven_steps):
+				solved, matchings = max_weight_matchings(block[unproven_steps, unproven_towers])
+				values[unproven_steps, unproven_towers] = solved
+				last = unproven_steps == len(block) - 1
+				self.matchings[unproven_towers[last]] = matchings[last]
+				self.solves += len(unproven_steps)
+			self.values = values[-1].copy()
+			hamming.append(len(self.assignment) - values)
+		self.tables = tables[-1].copy()
+		self.history.append((np.concatenate(hamming) if self.hamming else None,
+							entropy_from_tables(tables) if self.entropy else None))
+
+	#Distances of every step recorded since the last call as (hamming, entropy) (steps x towers) arrays like
+	#tower_distances, with None for a distance that isn't tracked. Recorded steps are dropped afterwards
+	def distances(self):
+		history = self.history
+		self.history = list()
+		empty = np.zeros((0, len(self.towers)))
+		hamming = np.concatenate([step[0] for step in history]) if self.hamming and history else empty.astype(np.intp)
+		entropy = np.concatenate([step[1] for step in history]) if self.entropy and history else empty
+		return (hamming if self.hamming else None, entropy if self.entropy else None)
+
+
+#Distances between every step of a chain given as consecutive plans and every tower, tracked with a
+#TowerTracker. Gives the same output as tower_distances on the same plans
+def track_towers(graph, partitions, towers, hamming = True, entropy = True, chunk_size = None):
+	if chunk_size is None:
+		chunk_size = tower_chunk_rows(canonical_array(np.asarray(towers)))
+	tracker = None
+	hamming_output = list()
+	entropy_output = list()
+	for chunk in plan_chunks(partitions, chunk_size):
+		if tracker is None:
+			tracker = TowerTracker(graph, chunk[0], towers, hamming, entropy)
+		tracker.advance(chunk)
+		step_hamming, step_entropy = tracker.distances()
+		hamming_output.append(step_hamming)
+		entropy_output.append(step_entropy)
+	if tracker is None:
+		return tower_distances(graph, list(), towers, hamming, entropy)
+	return (np.concatenate(hamming_output) if hamming else None, np.concatenate(entropy_output) if entropy else None)
 
 
 #generates num_towers-many partitions of graph into num_dists-many districts. Chooses
-#partitions from a larger pool to avoid having close together towers. This is calculated
-#using either hamming distance (when hamming == True) or entropy distance (when hamming == False)
+#partitions from a larger pool of num_options candidates (default num_towers*5) to avoid having close
+#together towers. This is calculated using either hamming distance (when hamming == True) or entropy
+#distance (when hamming == False)
 #Districts must be contiguous, but can also have population constraints. Pop constraint is the
 #percentage that outputted district populations may vary from the ideal district population 
 #size (total population / num_dists). Default of 100 is equivalent to no population constraint
@@ -233,62 +883,67 @@ from spanning_trees.main import explore_random
 #ideal population = 10/2 = 5
 #allowed range of district populations = 5 - .2*5 - 5 + .2*5 = 4-6
 #so only partitions for which both districts have population 4, 5, or 6 are outputted
-def create_towers(graph, num_dists, num_towers = 3, hamming = True, pop_constraint = 100):
-	if hamming:
-		distance_measure = unlabeled_hamming_distance
-	else:
-		distance_measure = partition_entropy
-
-	num_options = num_towers*5
-	tower_options = explore_random(graph, num_options, num_dists, pictures = False, 
-					divide_and_conquer = False, equi = False, delta = pop_constraint)
-	for t in range(num_options):
-		assignments = dict()
-		for dist in range(num_dists):
-			tower_options[t][dist] = {x : dist for x in tower_options[t][dist].nodes}
-			assignments.update(tower_options[t][dist])
-		tower_options[t] = assignments
-
-	distances = dict()
-	for o2 in range(num_options):
-		for o1 in range(o2):
-			if (o1,o2) not in distances:
-				distances[(o1,o2)] = distance_measure(graph,tower_options[o1], tower_options[o2])
-
-	if num_towers == 1:
-		towers = [1]
-	else:
-		(t1,t2) = max(distances.items(), key=operator.itemgetter(1))[0]
-		towers = [t1,t2]
-
-	while len(towers) < num_towers:
-		dists = dict()
-		for o in range(num_options):
-			if o in towers:
-				continue
-			total = list()
-			for t in towers:
-				total.append(tuple(sorted([o,t])))
-			dists[o] = min(total)
-		towers.append(max(dists.items(), key=operator.itemgetter(1))[0])
-
-	pairs = list()
+#Candidates are drawn by cutting random spanning trees (see tree_partitions.py) using the pop_name node
+#attribute, which is only read when pop_constraint limits the populations. With processes (None for one per CPU), the candidates and their pairwise distances are computed in
+#worker processes, which needs an if __name__ == '__main__' guard in the calling script on platforms that spawn
+#them; by default everything runs in this process.
+#Towers are picked by farthest point selection: the farthest apart pair first, then repeatedly the candidate
+#whose distance to its nearest chosen tower is largest.
+#Outputs (towers, distances) where towers are canonical form tuples with nodes in sorted order and distances
+#lists the distance of each pair of towers (0,1), (0,2), (1,2), (0,3)...
+def create_towers(graph, num_dists, num_towers = 3, hamming = True, pop_constraint = 100, num_options = None,
+					pop_name = 'POP', seed = None, processes = 1):
+	if num_options is None:
+		num_options = num_towers*5
+	if num_options < num_towers:
+		raise ValueError('num_options must be at least num_towers')
+	tower_options = random_partitions(graph, num_dists, num_options, pop_constraint, pop_name, seed, processes)
+	distances = option_distances(tower_options, hamming, processes)
+	towers = farthest_points(distances, num_towers)
+
 	tower_distances = list()
 	for t1 in range(num_towers):
 		for t2 in range(t1):
-			pair = [towers[t1],towers[t2]]
-			pair.sort()
-			pair = tuple(pair)
-			pairs.append((t2,t1))
-			tower_distances.append(distances[pair])
-
-	canon_towers = list()
-	for t in towers:
-		assign_dict = tower_options[t]
-		assign_list = [assign_dict[node] for node in range(len(assign_dict))]
-		canon_towers.append(canonical_form(assign_list))
+			tower_distances.append(distances[towers[t2], towers[t1]].item())
+
+	canon_towers = [canonical_form(tower_options[t].tolist()) for t in towers]
 	return (canon_towers, tower_distances)
-'''
+
+
+#Distances between row blocks of options and every option, run in worker processes by option_distances
+def option_block_distances(options, hamming, block):
+	distances = tower_distances(None, options[block], options, hamming = hamming, entropy = not hamming)
+	return distances[0] if hamming else distances[1]
+
+
+#Symmetric matrix of distances between every pair of options, where the distance of a pair i < j is taken with
+#option i as the partition and option j as the tower (entropy distance isn't symmetric)
+def option_distances(options, hamming = True, processes = 1):
+	blocks = [slice(start, start + 256) for start in range(0, len(options), 256)]
+	block_distances = partial(option_block_distances, options, hamming)
+	if processes == 1 or len(blocks) == 1:
+		distances = np.concatenate([block_distances(block) for block in blocks])
+	else:
+		with ProcessPoolExecutor(max_workers = processes) as executor:
+			distances = np.concatenate(list(executor.map(block_distances, blocks)))
+	distances = np.triu(distances, 1)
+	return distances + distances.T
+
+
+#Indices of num_points points chosen by farthest point selection from a symmetric distance matrix
+def farthest_points(distances, num_points):
+	if num_points == 1:
+		return [0]
+	first, second = np.unravel_index(np.argmax(distances), distances.shape)
+	points = [int(first), int(second)]
+	nearest = np.minimum(distances[first], distances[second]).astype(float)
+	while len(points) < num_points:
+		nearest[points] = -np.inf
+		point = int(np.argmax(nearest))
+		points.append(point)
+		nearest = np.minimum(nearest, distances[point])
+	return points
+
 
 #===========================================================================================
 #Distance calculation algorithms written by Robert Dougherty-Bliss
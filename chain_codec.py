@@ -0,0 +1,179 @@
+import numpy as np
+import sys
+from benchmark_calculations import canonical_array, canonical_form, label_dtype, plan_chunks, chain_moves
+from ensemble_format import load_ensemble
+
+
+#This file stores MCMC chains as a keyframe plus deltas instead of one full plan per step. Lazy chains repeat the
+#same plan many steps in a row and flip chains only change a node or a few nodes per step, so a chain is saved as
+#	keyframe : the plan at step 0
+#	run_lengths : how many consecutive steps each distinct state lasts, so repeats cost nothing
+#	deltas : the (node, new district) moves that turn each state into the next one, with delta_ptr[s] to
+#			 delta_ptr[s+1] indexing the moves into state s (the move's step is the first step of state s)
+#
+#Canonical form relabels every district whenever a flip changes which district appears first, which would make
+#a single flip look like hundreds of moves. The encoder records moves in the consistent labeling of
+#benchmark_calculations.chain_moves (each step's districts matched to the previous step's by overlap), and the
+#decoder canonicalizes plans on the way out.
+#
+#Functions:
+#
+#ChainEncoder : encodes consecutive canonical plans chunk by chunk
+#encode_chain : encodes a list/array of plans (or an iterable of chunks) into an EncodedChain
+#EncodedChain : decoder, reconstructs any step (chain[step]) or streams all steps (chain.iter_plans())
+#save_chain : encodes plans into a compressed .npz file
+#load_chain : loads an EncodedChain saved with save_chain
+#
+#From the command line, python chain_codec.py chain.ens chain.npz encodes an ensemble file
+
+
+#Encodes a chain as it is produced, one chunk of consecutive plans at a time
+#Ex: encoder = ChainEncoder()
+#	for chunk in iter_chain_canon(chain, 10000):
+#		encoder.append(chunk)
+#	encoded = encoder.finish()
+class ChainEncoder:
+
+	def __init__(self):
+		self.keyframe = None
+		self.run_lengths = list()
+		self.delta_counts = list()
+		self.delta_nodes = list()
+		self.delta_districts = list()
+		self.current_run = 0
+
+	def append(self, plans):
+		plans = canonical_array(plans).astype(np.intp)
+		if plans.ndim == 1:
+			plans = plans[np.newaxis]
+		if len(plans) == 0:
+			return
+		if self.keyframe is None:
+			self.keyframe = plans[0].copy()
+			self.num_dists = int(plans[0].max())
+			#perm[canonical label] = encoder label, starting from the keyframe's labels
+			self.perm = np.arange(self.num_dists + 1)
+			self.previous = plans[0]
+		if plans.max() > self.num_dists:
+			raise ValueError('chain has more districts than its first plan')
+
+		#moves of the chunk in the encoder's labeling, see benchmark_calculations.chain_moves. Plans are canonical,
+		#so every step that changes the plan moves at least one node
+		steps, nodes, old, districts, self.perm = chain_moves(self.previous, plans, self.perm)
+		self.previous = plans[-1].copy()
+		if len(steps) == 0:
+			self.current_run += len(plans)
+			return
+		moved, counts = np.unique(steps, return_counts = True)
+
+		#steps between moves repeat the current state
+		run_ends = np.append(moved, len(plans))
+		self.run_lengths.append(np.array([self.current_run + moved[0]]))
+		self.run_lengths.append(np.diff(run_ends)[:-1])
+		self.current_run = run_ends[-1] - run_ends[-2]
+		self.delta_counts.append(counts)
+		self.delta_nodes.append(nodes)
+		self.delta_districts.append(districts)
+
+	def finish(self):
+		if self.keyframe is None:
+			raise ValueError('no plans were encoded')
+		run_lengths = np.concatenate(self.run_lengths + [np.array([self.current_run])])
+		delta_counts = np.concatenate([np.zeros(1, dtype = np.intp)] + self.delta_counts)
+		delta_nodes = np.concatenate(self.delta_nodes) if self.delta_nodes else np.zeros(0, dtype = np.intp)
+		delta_districts = np.concatenate(self.delta_districts) if self.delta_districts else np.zeros(0, dtype = np.intp)
+		num_nodes = len(self.keyframe)
+		return EncodedChain(
+			keyframe = self.keyframe.astype(label_dtype(self.num_dists)),
+			run_lengths = run_lengths.astype(np.uint64),
+			delta_ptr = np.append(0, np.cumsum(delta_counts)).astype(np.int64),
+			delta_nodes = delta_nodes.astype(label_dtype(num_nodes)),
+			delta_districts = delta_districts.astype(label_dtype(self.num_dists)))
+
+
+#Decoder for an encoded chain. len(chain) is the number of steps, chain[step] is the canonical form plan at that
+#step as a tuple, and chain.iter_plans(chunk_size) streams every step as canonical (chunk_size x num_nodes) arrays
+class EncodedChain:
+
+	def __init__(self, keyframe, run_lengths, delta_ptr, delta_nodes, delta_districts):
+		self.keyframe = keyframe
+		self.run_lengths = run_lengths
+		self.delta_ptr = delta_ptr
+		self.delta_nodes = delta_nodes
+		self.delta_districts = delta_districts
+		self.state_ends = np.cumsum(run_lengths.astype(np.int64))
+
+	def __len__(self):
+		return int(self.state_ends[-1]) if len(self.state_ends) else 0
+
+	#number of distinct consecutive states, the number of steps once repeats are collapsed
+	def num_states(self):
+		return len(self.run_lengths)
+
+	def __getitem__(self, step):
+		if step < 0:
+			step += len(self)
+		if not 0 <= step < len(self):
+			raise IndexError('step out of range')
+		state = int(np.searchsorted(self.state_ends, step, side = 'right'))
+		end = self.delta_ptr[state + 1]
+		plan = self.keyframe.astype(np.intp)
+		#apply every move up to this state, where the last move of each node wins
+		nodes, last = np.unique(self.delta_nodes[:end][::-1], return_index = True)
+		plan[nodes] = self.delta_districts[:end][::-1][last]
+		return canonical_form(plan)
+
+	def iter_plans(self, chunk_size = 100000):
+		plan = self.keyframe.copy()
+		chunk = np.empty((chunk_size, len(plan)), dtype = plan.dtype)
+		filled = 0
+		for state in range(len(self.run_lengths)):
+			start, end = self.delta_ptr[state], self.delta_ptr[state + 1]
+			plan[self.delta_nodes[start:end]] = self.delta_districts[start:end]
+			repeats = int(self.run_lengths[state])
+			while repeats:
+				rows = min(repeats, chunk_size - filled)
+				chunk[filled:filled + rows] = plan
+				filled += rows
+				repeats -= rows
+				if filled == chunk_size:
+					yield canonical_array(chunk)
+					filled = 0
+		if filled:
+			yield canonical_array(chunk[:filled])
+
+	def __iter__(self):
+		for chunk in self.iter_plans():
+			for plan in chunk.tolist():
+				yield tuple(plan)
+
+
+#Encodes consecutive plans (anything plan_chunks accepts) into an EncodedChain
+def encode_chain(plans, chunk_size = 100000):
+	encoder = ChainEncoder()
+	for chunk in plan_chunks(plans, chunk_size):
+		encoder.append(chunk)
+	return encoder.finish()
+
+
+#Encodes plans and saves them to a compressed .npz file at path, outputs the EncodedChain
+def save_chain(path, plans, chunk_size = 100000):
+	encoded = plans if isinstance(plans, EncodedChain) else encode_chain(plans, chunk_size)
+	np.savez_compressed(path, keyframe = encoded.keyframe, run_lengths = encoded.run_lengths,
+						delta_ptr = encoded.delta_ptr, delta_nodes = encoded.delta_nodes,
+						delta_districts = encoded.delta_districts)
+	return encoded
+
+
+def load_chain(path):
+	with np.load(path) as data:
+		return EncodedChain(data['keyframe'], data['run_lengths'], data['delta_ptr'],
+							data['delta_nodes'], data['delta_districts'])
+
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		print('usage: python chain_codec.py chain.ens chain.npz')
+		sys.exit(1)
+	encoded = save_chain(sys.argv[2], load_ensemble(sys.argv[1]))
+	print('encoded %d steps as %d states and %d moves' % (len(encoded), encoded.num_states(), len(encoded.delta_nodes)))
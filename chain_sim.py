@@ -0,0 +1,308 @@
+import numpy as np
+import scipy.sparse as sparse
+import random
+import sys
+from benchmark_calculations import canonical_array
+from contiguity import read_adjacency_csv, connected_sets, ContiguityChecker
+from ensemble_format import EnsembleWriter
+from tree_partitions import random_partition
+
+
+#This file runs single flip chains (the proposal methods described in the README) directly on arrays, so
+#ensembles for the benchmarks can be produced without RunDMCMC and pickles. The chain keeps its assignment as an
+#array, the set of cut edges (edges between two districts) in a list that can be sampled from in constant time,
+#and district populations, all updated as nodes are flipped. Proposals follow the same rules as the transition
+#matrices of mixing.py: an edge between two districts is chosen at random, one of its endpoints is flipped into
+#the other's district, and invalid proposals (breaking contiguity, removing a district or leaving the population
+#bounds) are drawn again.
+#	not lazy : every step moves
+#	wes lazy : moves with probability (number of cut edges) / max_cut_edges, stays put otherwise
+#	real degree lazy : moves with probability degree / max_degree to a uniformly chosen valid neighbor, where
+#			   the degree is the number of valid single flips. The valid flips are kept in a set updated from
+#			   each move's neighborhood: after a node moves from district A to B, only the boundary nodes of A
+#			   and B (and, with population bounds, their neighbors across cut edges) are checked again, each
+#			   with ContiguityChecker.can_remove's local shortcuts. A step costs about the boundary sizes of the
+#			   two districts plus a search of the small pieces cut off by their articulation points, rather
+#			   than a pass over the whole graph (about 4.5 ms a step on a 60 x 60 grid split into three
+#			   districts, against 6 ms to recompute every valid flip, and far less for districts with short
+#			   boundaries)
+#	chunk flip : the flipped node takes along a connected chunk of up to max_chunk nodes of its district,
+#			   chosen with probability proportional to chunk_decay ** (size - 1)
+#
+#Functions:
+#
+#CutEdgeSet : set of edge IDs (or other items, like flips) supporting constant time add, remove and random choice
+#ChainSimulator : runs a chain step by step and streams its plans in canonical form (or as plan IDs)
+#simulate_plans : runs a chain and outputs all of its canonical plans as an array
+#
+#From the command line, python chain_sim.py adjacency.csv 'not lazy' 1000000 chain.ens runs a chain from a
+#random spanning tree partition into 3 districts and saves it as an ensemble file
+
+
+PROPOSALS = ('not lazy', 'wes lazy', 'real degree lazy', 'chunk flip')
+
+
+class CutEdgeSet:
+
+	def __init__(self):
+		self.items = list()
+		self.positions = dict()
+
+	def __len__(self):
+		return len(self.items)
+
+	def add(self, item):
+		if item not in self.positions:
+			self.positions[item] = len(self.items)
+			self.items.append(item)
+
+	#removes item by moving the last item into its place
+	def discard(self, item):
+		position = self.positions.pop(item, None)
+		if position is None:
+			return
+		last = self.items.pop()
+		if position < len(self.items):
+			self.items[position] = last
+			self.positions[last] = position
+
+	def choice(self, rng):
+		return self.items[int(rng.random() * len(self.items))]
+
+
+#Runs a chain over the graph with the given adjacency matrix (see contiguity.py) from initial_plan, an array of
+#district labels indexed by node. pops and pop_bounds = (low, high) optionally keep district populations within
+#bounds. wes lazy needs max_cut_edges (by default the number of edges of the graph) and real degree lazy needs
+#max_degree; use the values mixing.py uses on an enumeration to compare against its exact results
+#Ex: simulator = ChainSimulator(adjacency, plan, 'wes lazy', seed = 1)
+#	for chunk in simulator.run(1000000):         #(10000 x num_nodes) arrays of canonical plans
+#		...
+class ChainSimulator:
+
+	def __init__(self, adjacency, initial_plan, proposal = 'not lazy', pops = None, pop_bounds = None,
+					max_cut_edges = None, max_degree = None, max_chunk = 3, chunk_decay = 0.5, seed = None):
+		if proposal not in PROPOSALS:
+			raise ValueError('unknown proposal: ' + str(proposal))
+		if proposal == 'real degree lazy' and max_degree is None:
+			raise ValueError('real degree lazy needs max_degree')
+		if pop_bounds is not None and pops is None:
+			raise ValueError('pop_bounds needs pops')
+		edges = sparse.triu(sparse.coo_matrix(adjacency), k = 1)
+		self.edges = list(zip(edges.row.tolist(), edges.col.tolist()))
+		self.checker = ContiguityChecker(adjacency)
+		self.neighbors = self.checker.neighbors
+		self.node_edges = [list() for node in self.neighbors]
+		for edge, (u, v) in enumerate(self.edges):
+			self.node_edges[u].append((v, edge))
+			self.node_edges[v].append((u, edge))
+		self.proposal = proposal
+		self.assignment = np.array(initial_plan, dtype = np.intp)
+		self.district_sizes = np.bincount(self.assignment)
+		self.pops = None if pops is None else np.asarray(pops, dtype = float)
+		self.pop_bounds = pop_bounds
+		if self.pops is not None:
+			self.district_pops = np.bincount(self.assignment, weights = self.pops)
+		self.max_cut_edges = len(self.edges) if max_cut_edges is None else max_cut_edges
+		self.max_degree = max_degree
+		self.max_chunk = max_chunk if proposal == 'chunk flip' else 1
+		self.chunk_decay = chunk_decay
+		self.rng = random.Random(seed)
+		self.cut_edges = CutEdgeSet()
+		for edge, (u, v) in enumerate(self.edges):
+			if self.assignment[u] != self.assignment[v]:
+				self.cut_edges.add(edge)
+		self.flips = None
+		if proposal == 'real degree lazy':
+			self.track_flips()
+
+	#Sets up the valid single flips of real degree lazy: boundary[node] counts node's neighbors in each other
+	#district, district_boundary[district] holds the nodes of district with a neighbor elsewhere, removable marks
+	#the nodes that can leave their district (kept up to date for boundary nodes), flips holds every valid
+	#(node, district) flip and node_flips[node] the districts node can currently flip to
+	def track_flips(self):
+		self.boundary = [dict() for node in self.neighbors]
+		self.district_boundary = dict()
+		for node, neighbors in enumerate(self.neighbors):
+			for other in neighbors:
+				if self.assignment[other] != self.assignment[node]:
+					district = self.assignment[other]
+					self.boundary[node][district] = self.boundary[node].get(district, 0) + 1
+			if self.boundary[node]:
+				self.district_boundary.setdefault(self.assignment[node], set()).add(node)
+		self.removable = self.checker.removable(self.assignment)
+		self.flips = CutEdgeSet()
+		self.node_flips = [set() for node in self.neighbors]
+		for nodes in self.district_boundary.values():
+			for node in nodes:
+				self.refresh_flips(node, False)
+
+	#Updates the boundary counts of node and its neighbors for node moving from district old to district new
+	def move_boundary(self, node, old, new):
+		boundary = self.boundary[node]
+		boundary.clear()
+		for other in self.neighbors[node]:
+			district = self.assignment[other]
+			if district != new:
+				boundary[district] = boundary.get(district, 0) + 1
+			other_boundary = self.boundary[other]
+			if district != old:
+				other_boundary[old] -= 1
+				if other_boundary[old] == 0:
+					del other_boundary[old]
+			if district != new:
+				other_boundary[new] = other_boundary.get(new, 0) + 1
+			if other_boundary:
+				self.district_boundary.setdefault(district, set()).add(other)
+			else:
+				self.district_boundary.get(district, set()).discard(other)
+		self.district_boundary.get(old, set()).discard(node)
+		if boundary:
+			self.district_boundary.setdefault(new, set()).add(node)
+
+	#Recomputes the valid flips of node, checking again whether it can leave its district when check is True
+	def refresh_flips(self, node, check = True):
+		for district in self.node_flips[node]:
+			self.flips.discard((node, district))
+		self.node_flips[node] = set()
+		own = self.assignment[node]
+		if check:
+			self.removable[node] = bool(self.boundary[node]) and self.checker.can_remove(
+				self.assignment, node, self.district_sizes[own])
+		if not self.removable[node]:
+			return
+		for district in self.boundary[node]:
+			if self.pop_bounds is not None and (self.district_pops[own] - self.pops[node] < self.pop_bounds[0] or
+												self.district_pops[district] + self.pops[node] > self.pop_bounds[1]):
+				continue
+			self.flips.add((node, district))
+			self.node_flips[node].add(district)
+
+	#Updates the valid flips after nodes moved between the districts changed: boundary nodes of those districts
+	#may have become (or stopped being) articulation points, and the moved nodes' neighbors may have gained or
+	#lost a district to flip to. With population bounds, flips into the changed districts from elsewhere are
+	#checked again too
+	def update_flips(self, nodes, changed):
+		checked = set()
+		for district in changed:
+			checked.update(self.district_boundary.get(district, ()))
+		for node in nodes:
+			checked.update(self.neighbors[node])
+		unchecked = set()
+		if self.pop_bounds is not None:
+			for node in checked:
+				for other in self.neighbors[node]:
+					if other not in checked and self.assignment[other] not in changed:
+						unchecked.add(other)
+		for node in checked:
+			self.refresh_flips(node, True)
+		for node in unchecked:
+			self.refresh_flips(node, False)
+
+	#True if moving nodes from their district into district keeps districts contiguous, non-empty and within the
+	#population bounds
+	def valid(self, nodes, district):
+		if self.pop_bounds is not None:
+			moved_pop = self.pops[list(nodes)].sum()
+			if (self.district_pops[self.assignment[nodes[0]]] - moved_pop < self.pop_bounds[0] or
+					self.district_pops[district] + moved_pop > self.pop_bounds[1]):
+				return False
+		district_size = self.district_sizes[self.assignment[nodes[0]]]
+		if len(nodes) == 1:
+			return self.checker.can_remove(self.assignment, nodes[0], district_size)
+		return self.checker.can_remove_set(self.assignment, nodes, district_size)
+
+	def flip(self, nodes, district):
+		changed = {district}
+		for node in nodes:
+			old = self.assignment[node]
+			changed.add(old)
+			if self.pops is not None:
+				self.district_pops[self.assignment[node]] -= self.pops[node]
+				self.district_pops[district] += self.pops[node]
+			self.district_sizes[self.assignment[node]] -= 1
+			self.district_sizes[district] += 1
+			self.assignment[node] = district
+			for (other, edge) in self.node_edges[node]:
+				if self.assignment[other] != district:
+					self.cut_edges.add(edge)
+				else:
+					self.cut_edges.discard(edge)
+			if self.flips is not None:
+				self.move_boundary(node, old, district)
+		if self.flips is not None:
+			self.update_flips(nodes, changed)
+
+	#Draws proposals until one is valid and outputs it as (nodes, district)
+	def propose(self, max_attempts = 100000):
+		for attempt in range(max_attempts):
+			u, v = self.edges[self.cut_edges.choice(self.rng)]
+			head, tail = (u, v) if self.rng.random() < 0.5 else (v, u)
+			nodes = (tail,)
+			if self.max_chunk > 1:
+				chunks = connected_sets(self.neighbors, self.assignment, tail, self.max_chunk)
+				weights = [self.chunk_decay ** (len(chunk) - 1) for chunk in chunks]
+				nodes = self.rng.choices(chunks, weights)[0]
+			district = self.assignment[head]
+			if self.valid(nodes, district):
+				return nodes, district
+		raise ValueError('no valid proposal found in %d attempts' % max_attempts)
+
+	#Distinct valid single flips of the current plan, as a list of (node, district)
+	def valid_flips(self):
+		nodes, districts = self.checker.valid_flips(self.assignment)[:2]
+		if self.pop_bounds is not None:
+			moved_pops = self.pops[nodes]
+			fits = ((self.district_pops[self.assignment[nodes]] - moved_pops >= self.pop_bounds[0]) &
+					(self.district_pops[districts] + moved_pops <= self.pop_bounds[1]))
+			nodes, districts = nodes[fits], districts[fits]
+		return list(zip(nodes.tolist(), districts.tolist()))
+
+	#Advances the chain one step, outputs True if the plan changed
+	def step(self):
+		if self.proposal == 'wes lazy' and self.rng.random() >= len(self.cut_edges) / self.max_cut_edges:
+			return False
+		if self.proposal == 'real degree lazy':
+			if self.rng.random() >= len(self.flips) / self.max_degree:
+				return False
+			node, district = self.flips.choice(self.rng)
+			self.flip((node,), district)
+			return True
+		self.flip(*self.propose())
+		return True
+
+	#Yields the plans of steps steps (the current plan first) as canonical (chunk_size x num_nodes) arrays, or as
+	#arrays of plan IDs when a plan_index.PlanIndex of every reachable plan is given
+	def run(self, steps, chunk_size = 10000, plan_index = None):
+		chunk = np.empty((min(chunk_size, steps), len(self.assignment)), dtype = np.intp)
+		filled = 0
+		for step in range(steps):
+			if step:
+				self.step()
+			chunk[filled] = self.assignment
+			filled += 1
+			if filled == len(chunk) or step == steps - 1:
+				plans = canonical_array(chunk[:filled])
+				yield plans if plan_index is None else plan_index.lookup(plans)
+				filled = 0
+
+
+#Runs a chain of steps steps (see ChainSimulator) and outputs its canonical plans as one array. Being a plain
+#function it can be given to plots/pipeline.run_benchmarks with functools.partial in place of an ensemble path
+def simulate_plans(adjacency, initial_plan, steps, proposal = 'not lazy', seed = None, **options):
+	simulator = ChainSimulator(adjacency, initial_plan, proposal, seed = seed, **options)
+	chunks = list(simulator.run(steps))
+	return np.concatenate(chunks) if chunks else np.zeros((0, len(initial_plan)), dtype = np.uint8)
+
+
+if __name__ == '__main__':
+	if len(sys.argv) != 5:
+		print("usage: python chain_sim.py adjacency.csv 'not lazy' steps chain.ens")
+		sys.exit(1)
+	adjacency = read_adjacency_csv(sys.argv[1])
+	num_nodes = adjacency.shape[0]
+	initial_plan = random_partition(adjacency, np.ones(num_nodes), 3, 1, num_nodes, np.random.default_rng(0))
+	simulator = ChainSimulator(adjacency, initial_plan, sys.argv[2], seed = 0)
+	with EnsembleWriter(sys.argv[4], num_nodes, 3, canonicalize = False) as writer:
+		for chunk in simulator.run(int(sys.argv[3])):
+			writer.write(chunk)
+	print('wrote %d steps' % writer.num_plans)
@@ -0,0 +1,283 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse as sparse
+
+
+#This file checks that districts stay contiguous when a node is flipped out of them. Graphs are handled as
+#symmetric scipy CSR adjacency matrices indexed by node position (sorted node order for networkx graphs), read
+#either from a networkx graph or from an adjacency list csv like fifield_ FL_adjacency_list.csv, where row i
+#lists the neighbors of node i (rows are padded with empty fields).
+#
+#Functions:
+#
+#read_adjacency_csv : adjacency matrix from an adjacency list csv
+#graph_adjacency : adjacency matrix of a networkx graph or a graph_data.GraphData
+#adjacency_lists : neighbor lists of every node, the form connected_without traverses
+#connected_without : whether a node's district is still connected (and not empty) once the node leaves it
+#connected_sets : connected sets of nodes around a node within its district, the chunks of a chunk flip
+#flip_proposals : the distinct single flips of a plan and how many proposals lead to each
+#ContiguityChecker : fast checks with local shortcuts and early stopping searches, articulation points of
+#					every district of a plan at once, and all valid single flips of a plan
+
+
+def read_adjacency_csv(path):
+	rows = list()
+	cols = list()
+	num_nodes = 0
+	with open(path) as f:
+		for node, line in enumerate(f):
+			neighbors = [int(float(field)) for field in line.strip().split(',') if field.strip()]
+			rows.extend([node] * len(neighbors))
+			cols.extend(neighbors)
+			num_nodes = node + 1
+	num_nodes = max([num_nodes] + [col + 1 for col in cols])
+	adjacency = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)), shape = (num_nodes, num_nodes)).tocsr()
+	adjacency = adjacency + adjacency.T
+	adjacency.setdiag(0)
+	adjacency.eliminate_zeros()
+	return (adjacency > 0).astype(np.int8).tocsr()
+
+
+#Adjacency matrix of a networkx graph in sorted node order, or of a graph_data.GraphData
+def graph_adjacency(graph):
+	if not isinstance(graph, nx.Graph):
+		return sparse.csr_matrix(graph.adjacency(), dtype = np.int8)
+	adjacency = nx.to_scipy_sparse_array(graph, nodelist = sorted(graph.nodes), weight = None, format = 'csr')
+	return sparse.csr_matrix(adjacency, dtype = np.int8)
+
+
+def adjacency_lists(adjacency):
+	adjacency = sparse.csr_matrix(adjacency)
+	return [adjacency.indices[adjacency.indptr[node]:adjacency.indptr[node + 1]].tolist()
+			for node in range(adjacency.shape[0])]
+
+
+#True if the district of nodes (one node or a collection of nodes from the same district) in assignment (an
+#array of labels indexed by node) is connected and not empty without them, so they can be flipped to another
+#district without breaking contiguity or removing a district. The district is traversed from one of its other
+#nodes
+def connected_without(neighbors, assignment, nodes):
+	removed = {int(nodes)} if np.isscalar(nodes) else {int(node) for node in nodes}
+	district = assignment[next(iter(removed))]
+	size = int(np.count_nonzero(assignment == district)) - len(removed)
+	if size == 0:
+		return False
+	start = next((other for node in removed for other in neighbors[node]
+				if assignment[other] == district and other not in removed), None)
+	if start is None:
+		return False
+	seen = removed | {start}
+	stack = [start]
+	while stack:
+		current = stack.pop()
+		for other in neighbors[current]:
+			if other not in seen and assignment[other] == district:
+				seen.add(other)
+				stack.append(other)
+	return len(seen) - len(removed) == size
+
+
+#Connected sets of up to max_size nodes of node's district that contain node, as tuples of nodes. Each set is
+#produced once, by growing sets only with neighbors that haven't been excluded at an earlier branch
+def connected_sets(neighbors, assignment, node, max_size):
+	district = assignment[node]
+	sets = list()
+
+	def grow(current, frontier, excluded):
+		sets.append(tuple(sorted(current)))
+		if len(current) == max_size:
+			return
+		frontier = list(frontier)
+		for i, other in enumerate(frontier):
+			blocked = excluded | set(frontier[:i])
+			added = {new for new in neighbors[other] if assignment[new] == district and new not in current
+					and new not in blocked}
+			grow(current | {other}, (set(frontier[i + 1:]) | added) - {other}, blocked)
+
+	grow({node}, {other for other in neighbors[node] if assignment[other] == district}, set())
+	return sets
+
+
+#Single flips of plan across the directed edges (heads, tails): the tail of every edge between two districts
+#can be flipped into the head's district. Outputs (nodes, districts, counts) for each distinct flip
+def flip_proposals(plan, heads, tails):
+	cut = plan[heads] != plan[tails]
+	keys = tails[cut].astype(np.int64) * (int(plan.max()) + 1) + plan[heads[cut]]
+	keys, counts = np.unique(keys, return_counts = True)
+	return keys // (int(plan.max()) + 1), keys % (int(plan.max()) + 1), counts
+
+
+#Contiguity checks against a fixed graph. can_remove answers whether a node can leave its district, trying
+#cheap local checks before searching the district:
+#	the node has a single neighbor in its district : it's a leaf, removing it can't disconnect anything
+#	its neighbors in the district are connected to each other through nodes next to the node (its neighbor
+#		ring) : any path through the node can go around it
+#	otherwise : search the district from each of those neighbors at once, stopping as soon as they all meet or
+#		one of them has searched a whole piece of the district
+#For a whole plan at once, removable finds every node that can leave its district from the articulation points
+#of the graph without its cut edges (one linear pass), and valid_flips lists every valid single flip.
+#Ex: checker = ContiguityChecker(read_adjacency_csv('fifield_ FL_adjacency_list.csv'))
+#	checker.can_remove(plan, node)
+#	nodes, districts, counts = checker.valid_flips(plan)
+class ContiguityChecker:
+
+	def __init__(self, adjacency):
+		adjacency = sparse.coo_matrix(adjacency)
+		self.neighbors = adjacency_lists(adjacency)
+		self.neighbor_sets = [set(neighbors) for neighbors in self.neighbors]
+		self.heads, self.tails = adjacency.row, adjacency.col
+		#how can_remove calls were answered, by 'leaf', 'ring' or 'search'
+		self.answers = {'leaf' : 0, 'ring' : 0, 'search' : 0}
+
+	#True if node can leave its district in assignment (an array of labels indexed by node) without disconnecting
+	#or emptying it. district_size (the number of nodes in node's district) saves counting it when known
+	def can_remove(self, assignment, node, district_size = None):
+		district = assignment[node]
+		same = [other for other in self.neighbors[node] if assignment[other] == district]
+		if len(same) == 0:
+			return False
+		if len(same) == 1:
+			self.answers['leaf'] += 1
+			return True
+
+		#neighbor ring: nodes of the district adjacent to the node, plus those two steps away through them
+		ring = set(same)
+		reached = {same[0]}
+		stack = [same[0]]
+		while stack and len(reached & ring) < len(ring):
+			current = stack.pop()
+			for other in self.neighbors[current]:
+				if other not in reached and other != node and assignment[other] == district and \
+						(other in ring or self.neighbor_sets[other] & ring):
+					reached.add(other)
+					stack.append(other)
+		if ring <= reached:
+			self.answers['ring'] += 1
+			return True
+
+		self.answers['search'] += 1
+		if district_size is None:
+			district_size = int(np.count_nonzero(np.asarray(assignment) == district))
+		return self.search(assignment, {node}, ring, district_size - 1)
+
+	#True if nodes (a collection of nodes from one district) can leave their district together without
+	#disconnecting or emptying it
+	def can_remove_set(self, assignment, nodes, district_size = None):
+		removed = set(nodes)
+		district = assignment[next(iter(removed))]
+		targets = {other for node in removed for other in self.neighbors[node]
+					if assignment[other] == district and other not in removed}
+		if district_size is None:
+			district_size = int(np.count_nonzero(np.asarray(assignment) == district))
+		if district_size == len(removed) or not targets:
+			return False
+		return self.search(assignment, removed, targets, district_size - len(removed))
+
+	#Searches the district of targets without the removed nodes and outputs True if every target is reached from
+	#every other. One search grows from each target, a node at a time in turn, and searches that meet are merged,
+	#so the answer is True once they have all merged and False as soon as one runs out (it has seen a whole
+	#component without the other targets). A node that can't be removed usually cuts off a small piece of its
+	#district, which is then all that gets searched. With a single target, the search runs out and the component
+	#holds every target only if it is the rest of the district (remaining nodes)
+	def search(self, assignment, removed, targets, remaining):
+		targets = list(targets)
+		district = assignment[targets[0]]
+		if len(targets) == 1:
+			seen = {targets[0]}
+			stack = [targets[0]]
+			while stack:
+				current = stack.pop()
+				for other in self.neighbors[current]:
+					if other not in seen and other not in removed and assignment[other] == district:
+						seen.add(other)
+						stack.append(other)
+			return len(seen) == remaining
+
+		#owner[node] is the search that reached node, merged[search] the search it was merged into, if any
+		owner = {target : i for (i, target) in enumerate(targets)}
+		merged = list(range(len(targets)))
+		stacks = [[target] for target in targets]
+		searches = len(targets)
+
+		def root(search):
+			while merged[search] != search:
+				merged[search] = merged[merged[search]]
+				search = merged[search]
+			return search
+
+		while True:
+			for i in range(len(targets)):
+				if merged[i] != i:
+					continue
+				if not stacks[i]:
+					return False
+				current = stacks[i].pop()
+				for other in self.neighbors[current]:
+					if other in removed or assignment[other] != district:
+						continue
+					reached = owner.get(other)
+					if reached is None:
+						owner[other] = i
+						stacks[i].append(other)
+						continue
+					reached = root(reached)
+					if reached != i:
+						merged[reached] = i
+						stacks[i].extend(stacks[reached])
+						stacks[reached] = list()
+						searches -= 1
+						if searches == 1:
+							return True
+
+	#Boolean array of the articulation points of every district of assignment: nodes whose removal disconnects
+	#their district. Uses an iterative version of Tarjan's algorithm on the graph without its cut edges
+	def articulation_points(self, assignment):
+		labels = np.asarray(assignment).tolist()
+		num_nodes = len(labels)
+		discovered = [-1] * num_nodes
+		low = [0] * num_nodes
+		points = [False] * num_nodes
+		counter = 0
+		for root in range(num_nodes):
+			if discovered[root] != -1:
+				continue
+			discovered[root] = low[root] = counter
+			counter += 1
+			root_children = 0
+			stack = [(root, -1, iter(self.neighbors[root]))]
+			while stack:
+				node, parent, remaining = stack[-1]
+				for other in remaining:
+					if labels[other] != labels[node]:
+						continue
+					if discovered[other] == -1:
+						discovered[other] = low[other] = counter
+						counter += 1
+						stack.append((other, node, iter(self.neighbors[other])))
+						break
+					if other != parent:
+						low[node] = min(low[node], discovered[other])
+				else:
+					stack.pop()
+					if parent == -1:
+						continue
+					low[parent] = min(low[parent], low[node])
+					if parent == root:
+						root_children += 1
+					elif low[node] >= discovered[parent]:
+						points[parent] = True
+			points[root] = root_children > 1
+		return np.array(points, dtype = bool)
+
+	#Boolean array of the nodes that can leave their district: not articulation points and not alone
+	def removable(self, assignment):
+		assignment = np.asarray(assignment)
+		sizes = np.bincount(assignment)
+		return ~self.articulation_points(assignment) & (sizes[assignment] > 1)
+
+	#Valid single flips of assignment as (nodes, districts, counts), see flip_proposals
+	def valid_flips(self, assignment):
+		assignment = np.asarray(assignment)
+		nodes, districts, counts = flip_proposals(assignment, self.heads, self.tails)
+		valid = self.removable(assignment)[nodes]
+		return nodes[valid], districts[valid], counts[valid]
@@ -0,0 +1,186 @@
+import numpy as np
+import networkx as nx
+import pickle
+import bz2
+import json
+import struct
+import sys
+from benchmark_calculations import canonical_array, label_dtype, iter_chain_canon, plan_chunks
+
+
+#This file reads and writes ensembles of canonical form partitions in a compact binary format (.ens files)
+#meant to replace pickled lists of tuples. Plans are stored as packed unsigned district labels (uint8 for less
+#than 256 districts, uint16 for less than 65536) so a 25 node plan takes 25 bytes, and the file can be memory
+#mapped so plans are read straight from disk without being loaded or unpickled.
+#
+#File layout:
+#	magic (8 bytes) : b'\x93PLANS\x01\x00'
+#	header length (4 bytes, little endian unsigned int)
+#	header : JSON object with num_nodes, num_dists, dtype and node_order (the node label of each index, or
+#			 null), padded with spaces so the plans start at a multiple of 64 bytes
+#	plans : num_plans x num_nodes labels in row order. The number of plans is not stored, it follows from the
+#			file size, so a file can be written as a stream and appended to
+#
+#Functions:
+#
+#write_ensemble : writes a list or array of plans (or an iterable of chunks of plans) to a .ens file
+#EnsembleWriter : appends chunks of plans to a .ens file as they are produced
+#read_header : reads the header of a .ens file, including the number of plans
+#load_ensemble : memory maps a .ens file as a read-only (num_plans x num_nodes) array
+#iter_ensemble : yields the plans of a .ens file in chunks
+#convert_pickle : converts a pickled ensemble (optionally bz2 compressed) into a .ens file
+#save_chain_canon : streams the canonical steps of a gerrymandr/RunDMCMC chain into a .ens file
+#
+#From the command line, python ensemble_format.py old_ensemble.p new_ensemble.ens converts a pickle
+
+
+MAGIC = b'\x93PLANS\x01\x00'
+ALIGNMENT = 64
+
+
+def encode_header(num_nodes, num_dists, node_order = None):
+	if node_order is not None:
+		node_order = [node if isinstance(node, (int, str)) else str(node) for node in node_order]
+		if len(node_order) != num_nodes:
+			raise ValueError('node_order has %d nodes, expected %d' % (len(node_order), num_nodes))
+	header = json.dumps({
+		'num_nodes' : int(num_nodes),
+		'num_dists' : int(num_dists),
+		'dtype' : label_dtype(num_dists).str,
+		'node_order' : node_order
+	}).encode('utf-8')
+	padding = -(len(MAGIC) + 4 + len(header)) % ALIGNMENT
+	header += b' ' * padding
+	return MAGIC + struct.pack('<I', len(header)) + header
+
+
+#Appends plans to a .ens file. The number of districts has to be known up front since it decides the label type.
+#Plans are canonicalized on the way in unless canonicalize is False (for plans that are already canonical)
+#Ex: with EnsembleWriter('chain.ens', 25, 3) as writer:
+#		for chunk in chunks:
+#			writer.write(chunk)
+class EnsembleWriter:
+
+	def __init__(self, path, num_nodes, num_dists, node_order = None, canonicalize = True):
+		self.num_nodes = num_nodes
+		self.num_dists = num_dists
+		self.dtype = label_dtype(num_dists)
+		self.canonicalize = canonicalize
+		self.num_plans = 0
+		self.file = open(path, 'wb')
+		self.file.write(encode_header(num_nodes, num_dists, node_order))
+
+	def write(self, plans):
+		plans = np.asarray(plans)
+		if plans.ndim == 1:
+			plans = plans[np.newaxis]
+		if plans.size == 0:
+			return
+		if plans.shape[1] != self.num_nodes:
+			raise ValueError('plans have %d nodes, expected %d' % (plans.shape[1], self.num_nodes))
+		if self.canonicalize:
+			plans = canonical_array(plans)
+		if plans.min() < 1 or plans.max() > self.num_dists:
+			raise ValueError('district labels must be between 1 and %d' % self.num_dists)
+		self.file.write(np.ascontiguousarray(plans, dtype = self.dtype).tobytes())
+		self.num_plans += len(plans)
+
+	def close(self):
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+
+#Writes plans to a .ens file at path and outputs the number of plans written. plans can be a list of tuples, an
+#array, or any iterable plan_chunks accepts (such as iter_chain_canon(chain, chunk_size)). If num_dists isn't
+#given the plans are read once up front to find it, which needs a list or array
+def write_ensemble(path, plans, num_dists = None, node_order = None, canonicalize = True, chunk_size = 100000):
+	if num_dists is None:
+		plans = np.asarray(plans)
+		num_dists = int(canonical_array(plans).max()) if canonicalize else int(plans.max())
+	chunks = plan_chunks(plans, chunk_size)
+	first = next(chunks, None)
+	if first is None:
+		raise ValueError('no plans to write')
+	with EnsembleWriter(path, first.shape[1], num_dists, node_order, canonicalize) as writer:
+		writer.write(first)
+		for chunk in chunks:
+			writer.write(chunk)
+	return writer.num_plans
+
+
+#Reads the header of a .ens file as a dict with num_nodes, num_dists, dtype, node_order, plus num_plans and
+#offset (where the plans start in the file)
+def read_header(path):
+	with open(path, 'rb') as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError(path + ' is not an ensemble file')
+		(header_length,) = struct.unpack('<I', f.read(4))
+		header = json.loads(f.read(header_length).decode('utf-8'))
+		f.seek(0, 2)
+		file_size = f.tell()
+	header['offset'] = len(MAGIC) + 4 + header_length
+	row_size = header['num_nodes'] * np.dtype(header['dtype']).itemsize
+	#a partially written last plan (from an interrupted writer) is ignored
+	header['num_plans'] = (file_size - header['offset']) // row_size
+	return header
+
+
+#Opens a .ens file as a read-only (num_plans x num_nodes) array backed by the file, nothing is read from disk
+#until plans are accessed
+def load_ensemble(path):
+	header = read_header(path)
+	if header['num_plans'] == 0:
+		return np.zeros((0, header['num_nodes']), dtype = header['dtype'])
+	return np.memmap(path, dtype = header['dtype'], mode = 'r', offset = header['offset'],
+					shape = (header['num_plans'], header['num_nodes']))
+
+
+#Yields the plans of a .ens file as (chunk_size x num_nodes) arrays
+def iter_ensemble(path, chunk_size = 100000):
+	plans = load_ensemble(path)
+	for start in range(0, len(plans), chunk_size):
+		yield np.array(plans[start:start + chunk_size])
+
+
+#Loads a pickled ensemble, bz2 compressed or not (see the README), as a list of plans. Ensembles stored as
+#lists of records such as (partition, seats, efficiency gap) or (partition, degree) keep only the partitions
+def load_pickled_plans(pickle_path):
+	with open(pickle_path, 'rb') as f:
+		compressed = f.read(3) == b'BZh'
+	opener = bz2.BZ2File if compressed else open
+	with opener(pickle_path, 'rb') as f:
+		data = pickle.load(f)
+	if len(data) and isinstance(data[0][0], (tuple, list, np.ndarray)):
+		data = [record[0] for record in data]
+	return data
+
+
+#Converts a pickled ensemble into a .ens file, outputs the number of plans converted
+def convert_pickle(pickle_path, ensemble_path, node_order = None):
+	plans = canonical_array(load_pickled_plans(pickle_path))
+	return write_ensemble(ensemble_path, plans, int(plans.max()), node_order, canonicalize = False)
+
+
+#Runs a chain object from gerrymandr/RunDMCMC and streams its steps in canonical form into a .ens file at path,
+#chunk_size steps at a time, so memory use stays flat no matter how long the chain is. The node ordering
+#(sorted node labels) is saved in the header. Outputs the number of steps written
+def save_chain_canon(chain, path, chunk_size = 10000):
+	graph = chain.state.graph
+	num_dists = len(set(chain.state.assignment[node] for node in graph.nodes))
+	with EnsembleWriter(path, nx.number_of_nodes(graph), num_dists, sorted(graph.nodes),
+						canonicalize = False) as writer:
+		for chunk in iter_chain_canon(chain, chunk_size):
+			writer.write(chunk)
+	return writer.num_plans
+
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		print('usage: python ensemble_format.py ensemble.p ensemble.ens')
+		sys.exit(1)
+	print('converted %d plans' % convert_pickle(sys.argv[1], sys.argv[2]))
@@ -0,0 +1,240 @@
+import numpy as np
+import scipy.sparse as sparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from benchmark_calculations import label_dtype
+from contiguity import read_adjacency_csv
+from ensemble_format import EnsembleWriter
+
+
+#This file enumerates every partition of a small graph into num_dists contiguous districts (the ground truth
+#the benchmarks compare sampled ensembles against), optionally within population bounds, and writes them as an
+#ensemble file. Sets of nodes are Python ints used as bitmasks. District 1 is grown as a connected set around
+#node 0, district 2 around the lowest node not in district 1 and so on, so every partition is produced exactly
+#once and already in canonical form. A partial partition is dropped as soon as the unassigned nodes fall into
+#more connected pieces than districts left, or a piece can't hold a whole district's population. The first
+#district's search tree is branched out a few levels and its branches can be split across worker processes.
+#
+#Population constraint (as in create_towers), with ideal_pop = total population / num_dists:
+#	allowed population minimum = ideal_pop - ideal_pop * pop_constraint
+#	allowed population maximum = ideal_pop + ideal_pop * pop_constraint
+#
+#Functions:
+#
+#branch_states : one level of the search for connected sets, used to split the search across processes
+#connected_subsets : connected sets of nodes containing a root node within a set of allowed nodes
+#components : connected pieces of a set of nodes
+#enumerate_plans : yields every partition in canonical form, in chunks
+#write_enumeration : writes every partition to a .ens file
+#load_enumeration_csv : loads an enumeration stored as a csv with one plan per column
+#
+#From the command line, python enumeration.py adjacency.csv num_dists enumeration.ens [demographic_data.csv
+#pop_constraint] writes an enumeration, with population bounds when the last two arguments are given
+
+
+#state of each worker process, set up once by init_worker
+worker_state = dict()
+
+
+def neighbor_masks(adjacency):
+	adjacency = sparse.csr_matrix(adjacency)
+	masks = list()
+	for node in range(adjacency.shape[0]):
+		mask = 0
+		for other in adjacency.indices[adjacency.indptr[node]:adjacency.indptr[node + 1]].tolist():
+			mask |= 1 << int(other)
+		masks.append(mask)
+	return masks
+
+
+def mask_nodes(mask):
+	nodes = list()
+	while mask:
+		low_bit = mask & -mask
+		nodes.append(low_bit.bit_length() - 1)
+		mask ^= low_bit
+	return nodes
+
+
+def mask_pop(mask, pops):
+	return sum(pops[node] for node in mask_nodes(mask))
+
+
+#Connected pieces of the nodes in mask, as a list of masks
+def components(mask, neighbors):
+	pieces = list()
+	while mask:
+		piece = frontier = mask & -mask
+		while frontier:
+			low_bit = frontier & -frontier
+			frontier ^= low_bit
+			new = neighbors[low_bit.bit_length() - 1] & mask & ~piece
+			piece |= new
+			frontier |= new
+		pieces.append(piece)
+		mask &= ~piece
+	return pieces
+
+
+#A step of the search for connected sets is described by a state (current set, its population, extension,
+#excluded): the sets it still has to output are current and every connected set grown from it with nodes of
+#extension and their neighbors, leaving out excluded nodes. Each set is grown once since a branch excludes the
+#nodes of its earlier sibling branches
+def root_state(root, allowed, neighbors, pops):
+	root_bit = 1 << root
+	return (root_bit, pops[root], neighbors[root] & allowed & ~root_bit, root_bit)
+
+
+#The set of a search state on its own (as a state with an empty extension), followed by the states of its
+#branches. Branches are only taken while the population stays at most high
+def branch_states(state, allowed, neighbors, pops, high):
+	current, current_pop, extension, excluded = state
+	states = [(current, current_pop, 0, excluded)]
+	while extension:
+		low_bit = extension & -extension
+		extension ^= low_bit
+		node = low_bit.bit_length() - 1
+		if current_pop + pops[node] <= high:
+			grown = current | low_bit
+			states.append((grown, current_pop + pops[node],
+							(extension | (neighbors[node] & allowed & ~grown)) & ~excluded, excluded))
+		excluded |= low_bit
+	return states
+
+
+#Outputs every connected set of nodes within allowed reached from a search state (see above) with a population
+#of at most high, as a list of (mask, population)
+def grow_subsets(state, allowed, neighbors, pops, high):
+	subsets = list()
+
+	def grow(current, current_pop, extension, excluded):
+		subsets.append((current, current_pop))
+		while extension:
+			low_bit = extension & -extension
+			extension ^= low_bit
+			node = low_bit.bit_length() - 1
+			if current_pop + pops[node] <= high:
+				grown = current | low_bit
+				grow(grown, current_pop + pops[node],
+					(extension | (neighbors[node] & allowed & ~grown)) & ~excluded, excluded)
+			excluded |= low_bit
+
+	if state[1] <= high:
+		grow(*state)
+	return subsets
+
+
+#Outputs every connected set of nodes within allowed that contains root and has a population of at most high,
+#as a list of (mask, population)
+def connected_subsets(root, allowed, neighbors, pops, high):
+	return grow_subsets(root_state(root, allowed, neighbors, pops), allowed, neighbors, pops, high)
+
+
+#True if the unassigned nodes in mask can still be split into num_dists districts: no more pieces than
+#districts, and each piece holds at least one district's population and at most num_dists of them
+def splittable(mask, num_dists, neighbors, pops, low, high):
+	pieces = components(mask, neighbors)
+	if len(pieces) > num_dists:
+		return False
+	return all(low <= mask_pop(piece, pops) <= num_dists * high for piece in pieces)
+
+
+#Appends every partition of the nodes in mask into num_dists districts (num_dists >= 2) whose next district is
+#one of subsets, a list of (mask, population), to plans as lists of district masks following districts
+def extend_plans(mask, num_dists, districts, subsets, plans, neighbors, pops, low, high):
+	for district, district_pop in subsets:
+		rest = mask & ~district
+		if district_pop < low or rest == 0 or not splittable(rest, num_dists - 1, neighbors, pops, low, high):
+			continue
+		if num_dists == 2:
+			#splittable has already checked the last district is connected and within the bounds
+			plans.append(districts + [district, rest])
+			continue
+		root = (rest & -rest).bit_length() - 1
+		extend_plans(rest, num_dists - 1, districts + [district],
+					connected_subsets(root, rest, neighbors, pops, high), plans, neighbors, pops, low, high)
+
+
+def init_worker(neighbors, pops, num_dists, low, high):
+	worker_state.update(neighbors = neighbors, pops = pops, num_dists = num_dists, low = low, high = high)
+
+
+#Canonical plans (as a (num_plans x num_nodes) array) whose first district is reached from one of the search
+#states
+def plans_from_states(states):
+	neighbors, pops = worker_state['neighbors'], worker_state['pops']
+	num_dists, low, high = worker_state['num_dists'], worker_state['low'], worker_state['high']
+	all_nodes = (1 << len(neighbors)) - 1
+	plans = list()
+	for state in states:
+		extend_plans(all_nodes, num_dists, list(), grow_subsets(state, all_nodes, neighbors, pops, high), plans,
+					neighbors, pops, low, high)
+	labels = np.zeros((len(plans), len(neighbors)), dtype = label_dtype(num_dists))
+	for row, districts in enumerate(plans):
+		for label, district in enumerate(districts):
+			labels[row, mask_nodes(district)] = label + 1
+	return labels
+
+
+#Yields every partition of the graph with the given adjacency matrix into num_dists contiguous districts as
+#canonical (num_plans x num_nodes) arrays. With pops and pop_constraint, district populations are kept within
+#the bounds described above. The search for the first district is branched out until it has at least
+#work_items states, which are dealt into work_items pieces and handed to processes worker processes (None for one
+#per CPU, 1 to enumerate in this process). Worker processes are only started on request, as they need the calling
+#script to have an if __name__ == '__main__' guard on platforms that spawn them
+def enumerate_plans(adjacency, num_dists, pops = None, pop_constraint = None, processes = 1, work_items = 256):
+	neighbors = neighbor_masks(adjacency)
+	pops = [1.0] * len(neighbors) if pops is None else [float(pop) for pop in pops]
+	low, high = 0, float('inf')
+	if pop_constraint is not None:
+		ideal_pop = sum(pops) / num_dists
+		low, high = ideal_pop - ideal_pop * pop_constraint, ideal_pop + ideal_pop * pop_constraint
+	all_nodes = (1 << len(neighbors)) - 1
+	if len(components(all_nodes, neighbors)) > 1:
+		raise ValueError('graph is not connected')
+	if num_dists == 1:
+		if low <= sum(pops) <= high:
+			yield np.ones((1, len(neighbors)), dtype = label_dtype(num_dists))
+		return
+
+	states = [root_state(0, all_nodes, neighbors, pops)] if pops[0] <= high else list()
+	while len(states) < work_items and any(state[2] for state in states):
+		states = [branch for state in states for branch in branch_states(state, all_nodes, neighbors, pops, high)]
+	items = [states[i::work_items] for i in range(min(work_items, len(states)))]
+	worker_args = (neighbors, pops, num_dists, low, high)
+	if processes == 1:
+		init_worker(*worker_args)
+		for item in items:
+			yield plans_from_states(item)
+	else:
+		with ProcessPoolExecutor(max_workers = processes, initializer = init_worker,
+								initargs = worker_args) as executor:
+			for plans in executor.map(plans_from_states, items):
+				yield plans
+
+
+#Writes every partition (see enumerate_plans) to a .ens file at path, outputs the number of plans
+def write_enumeration(path, adjacency, num_dists, pops = None, pop_constraint = None, processes = 1):
+	with EnsembleWriter(path, adjacency.shape[0], num_dists, canonicalize = False) as writer:
+		for plans in enumerate_plans(adjacency, num_dists, pops, pop_constraint, processes):
+			writer.write(plans)
+	return writer.num_plans
+
+
+#Loads an enumeration stored as a csv where each column is a plan (the format old/function_tests.py and
+#old/walk_accuracy.py read), as a (num_plans x num_nodes) array
+def load_enumeration_csv(path):
+	return np.transpose(np.loadtxt(path, delimiter = ',', ndmin = 2)).astype(np.intp)
+
+
+if __name__ == '__main__':
+	if len(sys.argv) not in (4, 6):
+		print('usage: python enumeration.py adjacency.csv num_dists enumeration.ens [demographic_data.csv pop_constraint]')
+		sys.exit(1)
+	adjacency = read_adjacency_csv(sys.argv[1])
+	pops, pop_constraint = None, None
+	if len(sys.argv) == 6:
+		pops = np.loadtxt(sys.argv[4], delimiter = ',', skiprows = 1, ndmin = 2)[:, 0]
+		pop_constraint = float(sys.argv[5])
+	num_plans = write_enumeration(sys.argv[3], adjacency, int(sys.argv[2]), pops, pop_constraint, processes = None)
+	print('enumerated %d plans' % num_plans)
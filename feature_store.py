@@ -0,0 +1,172 @@
+import numpy as np
+import hashlib
+import json
+import os
+import sys
+from benchmark_calculations import ENSEMBLE_METRICS, score_partitions, plan_chunks, chunk_rows
+from ensemble_format import load_ensemble
+from plan_index import plan_hashes
+
+
+#This file keeps features of every plan of a fixed ensemble (usually the full enumeration) on disk, so benchmark
+#runs index precomputed arrays instead of rescoring the enumeration. A store is a directory holding one .npy
+#file per feature (a column, index-paired with the plans, so the value of plan ID i is column[i]) and a
+#meta.json recording:
+#	plans_hash : sha256 of the hashes of the plans in order. A store opened with different plans is emptied
+#	data_hash : sha256 of the democrat and republican votes each column was computed from. A column computed
+#				from other demographic data is stale and is computed again when next asked for
+#	columns : for each column, its data_hash and what computed it
+#Columns are computed the first time they are asked for: metrics of benchmark_calculations.ENSEMBLE_METRICS
+#are scored together in one pass over the plans, other features are functions of (plan, dem_votes,
+#rep_votes) like those in plots/utils.py, stored under the function's name. Columns are memory mapped when read.
+#
+#Functions:
+#
+#data_hash : hash of the vote data columns depend on
+#ensemble_hash : hash of the plans of an ensemble, in order
+#hist_bin_indices : histogram bin of each feature value, following np.histogram
+#FeatureStore : directory of feature columns for an ensemble, computed lazily
+#
+#From the command line, python feature_store.py plans.ens demographic_data.csv store_directory computes every
+#metric of ENSEMBLE_METRICS for an ensemble file
+
+
+def data_hash(dem_votes, rep_votes):
+	digest = hashlib.sha256()
+	for votes in (dem_votes, rep_votes):
+		digest.update(np.ascontiguousarray(votes, dtype = '<f8').tobytes())
+	return digest.hexdigest()
+
+
+def ensemble_hash(plans, chunk_size = 100000):
+	digest = hashlib.sha256()
+	for chunk in plan_chunks(plans, chunk_size):
+		digest.update(np.ascontiguousarray(plan_hashes(chunk), dtype = '<u8').tobytes())
+	return digest.hexdigest()
+
+
+#Bin of each of values (an array of feature values) in the histogram with the given bin edges, following
+#np.histogram: bins are closed on the left, the last bin is also closed on the right, and values outside the
+#edges get -1. Measured (plots/processing.py) and expected (mixing.py) histogram errors both bin with this
+def hist_bin_indices(values, bin_edges):
+	values = np.asarray(values)
+	num_bins = len(bin_edges) - 1
+	bins = np.searchsorted(bin_edges, values, side = 'right') - 1
+	bins[values == bin_edges[-1]] = num_bins - 1
+	bins[(bins < 0) | (bins >= num_bins)] = -1
+	return bins
+
+
+#Feature columns of plans (an array of canonical form plans, such as a PlanIndex's plans) kept in directory.
+#Plans are read chunk_size at a time, by default chunk_rows of the number of nodes
+#Ex: store = FeatureStore('data/features', all_plans, dems, reps)
+#	eff_gaps = store.column('eff_gap')             #computed and saved on the first run, loaded afterwards
+#	sizes = store.column(entropy)                   #a function of (plan, dem_votes, rep_votes)
+#	store.lookup('eff_gap', plan_index.lookup(sampled_plans))
+class FeatureStore:
+
+	def __init__(self, directory, plans, dem_votes, rep_votes, chunk_size = None):
+		self.directory = directory
+		self.plans = plans
+		self.dem_votes = np.asarray(dem_votes, dtype = float)
+		self.rep_votes = np.asarray(rep_votes, dtype = float)
+		self.chunk_size = chunk_size if chunk_size is not None else chunk_rows(len(self.dem_votes))
+		self.num_plans = len(plans)
+		self.plans_hash = ensemble_hash(plans, self.chunk_size)
+		self.data_hash = data_hash(self.dem_votes, self.rep_votes)
+		self.columns = dict()
+		os.makedirs(directory, exist_ok = True)
+		self.meta = {'plans_hash' : self.plans_hash, 'num_plans' : self.num_plans, 'columns' : dict()}
+		if os.path.exists(self.meta_path()):
+			with open(self.meta_path()) as f:
+				meta = json.load(f)
+			if meta.get('plans_hash') == self.plans_hash:
+				self.meta = meta
+			else:
+				for name in meta.get('columns', dict()):
+					if os.path.exists(self.column_path(name)):
+						os.remove(self.column_path(name))
+				self.save_meta()
+
+	def meta_path(self):
+		return os.path.join(self.directory, 'meta.json')
+
+	def column_path(self, name):
+		return os.path.join(self.directory, name + '.npy')
+
+	def save_meta(self):
+		self.meta['data_hash'] = self.data_hash
+		temporary = self.meta_path() + '.tmp'
+		with open(temporary, 'w') as f:
+			json.dump(self.meta, f, indent = 1)
+		os.replace(temporary, self.meta_path())
+
+	#True if the column is saved and was computed from the current vote data
+	def valid(self, name):
+		info = self.meta['columns'].get(name)
+		return info is not None and info['data_hash'] == self.data_hash and os.path.exists(self.column_path(name))
+
+	def names(self):
+		return [name for name in self.meta['columns'] if self.valid(name)]
+
+	def save_column(self, name, values, source):
+		values = np.asarray(values)
+		if len(values) != self.num_plans:
+			raise ValueError('column %s has %d values for %d plans' % (name, len(values), self.num_plans))
+		self.columns.pop(name, None)
+		temporary = self.column_path(name) + '.tmp.npy'
+		np.save(temporary, values)
+		os.replace(temporary, self.column_path(name))
+		self.meta['columns'][name] = {'data_hash' : self.data_hash, 'source' : source}
+		self.save_meta()
+
+	#Computes and saves the metrics of ENSEMBLE_METRICS that aren't stored yet (or are stale), all in one pass
+	def compute(self, metrics = tuple(ENSEMBLE_METRICS), recompute = False):
+		missing = [metric for metric in metrics if recompute or not self.valid(metric)]
+		if not missing:
+			return
+		scores = score_partitions(self.plans, self.dem_votes, self.rep_votes, missing, self.chunk_size)
+		for metric in missing:
+			self.save_column(metric, scores[metric], 'ENSEMBLE_METRICS')
+
+	#Column of a feature as a read-only array indexed by plan ID. feature is the name of a metric of
+	#ENSEMBLE_METRICS (or of a column already stored), or a function of (plan, dem_votes, rep_votes) stored under
+	#name (by default its __name__). With recompute, a stored column is computed again, for example after
+	#changing the function behind it
+	def column(self, feature, name = None, recompute = False):
+		if name is None:
+			name = feature if isinstance(feature, str) else feature.__name__
+		if recompute or not self.valid(name):
+			if callable(feature):
+				values = [feature(plan, self.dem_votes, self.rep_votes)
+							for chunk in plan_chunks(self.plans, self.chunk_size) for plan in chunk]
+				self.save_column(name, np.array(values, dtype = float), feature.__module__ + '.' + feature.__name__)
+			elif feature in ENSEMBLE_METRICS:
+				self.compute([feature], recompute)
+			else:
+				raise KeyError('no stored column %s and no way to compute it' % name)
+		if name not in self.columns:
+			self.columns[name] = np.load(self.column_path(name), mmap_mode = 'r')
+		return self.columns[name]
+
+	#Values of a column for an array of plan IDs (from PlanIndex.lookup)
+	def lookup(self, name, ids):
+		return self.column(name)[ids]
+
+	#Drops a column from the store
+	def remove(self, name):
+		self.columns.pop(name, None)
+		if self.meta['columns'].pop(name, None) is not None:
+			if os.path.exists(self.column_path(name)):
+				os.remove(self.column_path(name))
+			self.save_meta()
+
+
+if __name__ == '__main__':
+	if len(sys.argv) != 4:
+		print('usage: python feature_store.py plans.ens demographic_data.csv store_directory')
+		sys.exit(1)
+	demographic_data = np.loadtxt(sys.argv[2], delimiter = ',', skiprows = 1, ndmin = 2)
+	store = FeatureStore(sys.argv[3], load_ensemble(sys.argv[1]), demographic_data[:, 1], demographic_data[:, 2])
+	store.compute()
+	print('stored %s for %d plans' % (', '.join(store.names()), store.num_plans))
@@ -0,0 +1,175 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse as sparse
+import operator
+import weakref
+import sys
+from contiguity import read_adjacency_csv
+
+
+#This file compiles a graph and its node attributes into flat arrays once, so scoring, distance and contiguity
+#functions don't read graph.nodes[node][attr] node by node on every call. Nodes are numbered by their position
+#in sorted order (the order partitions are indexed by), and the adjacency is kept as CSR arrays: the neighbors of
+#node i are indices[indptr[i]:indptr[i + 1]]. Attributes missing from the source are None.
+#A GraphData can be passed wherever benchmark_calculations, tree_partitions and contiguity take a graph. Attribute
+#names used there (dv_name = 'DV', pop_name = 'POP'...) are matched to the arrays by ATTRIBUTE_SLOTS, or by the
+#lower case name.
+#
+#The sorted node order of a networkx graph (node label of each position, position of each label and a gather
+#reading an assignment dict in that order) is built once per graph by node_ordering and cached for as long as the
+#graph lives (and its node set stays the same), so canonicalizing RunDMCMC partitions doesn't copy or sort the
+#graph for every partition.
+#
+#Functions:
+#
+#NodeOrdering : sorted node order of a graph, with the reverse index and a gather for assignment dicts
+#node_ordering : cached NodeOrdering of a graph
+#GraphData : node order, CSR adjacency and population, vote and demographic arrays of a graph
+#
+#From the command line, python graph_data.py demographic_data.csv adjacency.csv prints a summary of the graph
+
+
+#graph attribute names and demographic_data.csv column names of each array
+ATTRIBUTE_SLOTS = {
+	'POP' : 'pop', 'DV' : 'dv', 'RV' : 'rv', 'BLACKPOP' : 'blackpop', 'HISPANICPOP' : 'hispanicpop',
+	'demvote' : 'dv', 'repvote' : 'rv',
+}
+DATA_SLOTS = ('pop', 'dv', 'rv', 'blackpop', 'hispanicpop')
+
+
+#orderings of the graphs seen so far, each dropped along with its graph
+orderings = weakref.WeakKeyDictionary()
+
+
+#Sorted node order of a graph (usually by GEOID), the order partitions are indexed by.
+#Ex: ordering = node_ordering(graph)
+#	ordering.nodes[i]                            #node label at position i
+#	ordering.index[label]                        #position of a node label
+#	ordering.labels(part.assignment)             #districts of an assignment dict, as a tuple in node order
+class NodeOrdering:
+
+	__slots__ = ('nodes', 'index', 'gather', '__weakref__')
+
+	def __init__(self, nodes):
+		nodes = sorted(nodes)
+		self.nodes = np.array(nodes)
+		if self.nodes.ndim != 1:
+			#tuple labels (like grid coordinates) are kept whole in an object array
+			self.nodes = np.empty(len(nodes), dtype = object)
+			for (i, node) in enumerate(nodes):
+				self.nodes[i] = node
+		self.index = {node : i for (i, node) in enumerate(nodes)}
+		if len(nodes) > 1:
+			self.gather = operator.itemgetter(*nodes)
+		else:
+			self.gather = lambda assignment: tuple(assignment[node] for node in nodes)
+
+	def __len__(self):
+		return len(self.nodes)
+
+	#Values of assignment (a dict or anything indexed by node label) for every node in order, as a tuple
+	def labels(self, assignment):
+		return self.gather(assignment)
+
+	#Same as labels as a (num_assignments x num_nodes) array for a list of assignments
+	def label_array(self, assignments):
+		return np.array([self.gather(assignment) for assignment in assignments])
+
+	#Positions of a list of node labels
+	def positions(self, nodes):
+		return np.array([self.index[node] for node in nodes], dtype = np.intp)
+
+
+#NodeOrdering of graph, built on the first call and cached against the graph object. The cached ordering is
+#checked against the graph's current node set on every call (a linear pass in C, cheap next to reading an
+#assignment), so nodes added, removed or relabeled in place get a new ordering
+def node_ordering(graph):
+	try:
+		ordering = orderings.get(graph)
+	except TypeError:
+		return NodeOrdering(graph.nodes)
+	if ordering is None or ordering.index.keys() != set(graph.nodes):
+		ordering = NodeOrdering(graph.nodes)
+		orderings[graph] = ordering
+	return ordering
+
+
+#Ex: data = GraphData.from_csv('demographic_data.csv', 'fifield_ FL_adjacency_list.csv')
+#	data = GraphData.from_networkx(graph)
+#	score_ensemble(data, plans)                   #same as score_ensemble(graph, plans)
+class GraphData:
+
+	__slots__ = ('nodes', 'indptr', 'indices') + DATA_SLOTS
+
+	def __init__(self, nodes, indptr, indices, pop = None, dv = None, rv = None, blackpop = None, hispanicpop = None):
+		self.nodes = np.asarray(nodes)
+		self.indptr = np.ascontiguousarray(indptr, dtype = np.intp)
+		self.indices = np.ascontiguousarray(indices, dtype = np.intp)
+		if len(self.indptr) != len(self.nodes) + 1:
+			raise ValueError('indptr has %d entries for %d nodes' % (len(self.indptr), len(self.nodes)))
+		for (name, values) in zip(DATA_SLOTS, (pop, dv, rv, blackpop, hispanicpop)):
+			if values is not None:
+				values = np.ascontiguousarray(values, dtype = float)
+				if len(values) != len(self.nodes):
+					raise ValueError('%s has %d values for %d nodes' % (name, len(values), len(self.nodes)))
+			setattr(self, name, values)
+
+	#Compiles a networkx graph, reading each attribute once. Nodes are taken in sorted order
+	@classmethod
+	def from_networkx(cls, graph, pop_name = 'POP', dv_name = 'DV', rv_name = 'RV', blackpop_name = 'BLACKPOP',
+						hispanicpop_name = 'HISPANICPOP'):
+		ordering = node_ordering(graph)
+		nodes = ordering.nodes.tolist()
+		adjacency = sparse.csr_matrix(nx.to_scipy_sparse_array(graph, nodelist = nodes, weight = None, format = 'csr'))
+		adjacency.sort_indices()
+		attributes = dict()
+		for (slot, name) in zip(DATA_SLOTS, (pop_name, dv_name, rv_name, blackpop_name, hispanicpop_name)):
+			values = [graph.nodes[node].get(name) for node in nodes] if name is not None else [None]
+			attributes[slot] = None if any(value is None for value in values) else values
+		return cls(ordering.nodes, adjacency.indptr, adjacency.indices, **attributes)
+
+	#Reads demographic_data.csv (a header row naming the columns, then one row per node) and an adjacency list csv
+	#like fifield_ FL_adjacency_list.csv. Nodes are numbered by row
+	@classmethod
+	def from_csv(cls, demographic_path, adjacency_path):
+		with open(demographic_path) as f:
+			names = [name.strip().strip('"') for name in f.readline().split(',')]
+		data = np.loadtxt(demographic_path, delimiter = ',', skiprows = 1, ndmin = 2)
+		attributes = {ATTRIBUTE_SLOTS.get(name, name.lower()) : data[:, i] for (i, name) in enumerate(names)}
+		adjacency = read_adjacency_csv(adjacency_path)
+		if adjacency.shape[0] != len(data):
+			raise ValueError('adjacency has %d nodes, demographic data %d' % (adjacency.shape[0], len(data)))
+		adjacency.sort_indices()
+		return cls(np.arange(len(data)), adjacency.indptr, adjacency.indices,
+					**{slot : values for (slot, values) in attributes.items() if slot in DATA_SLOTS})
+
+	def __len__(self):
+		return len(self.nodes)
+
+	def number_of_nodes(self):
+		return len(self.nodes)
+
+	#Symmetric scipy CSR adjacency matrix, as contiguity.graph_adjacency outputs for a networkx graph
+	def adjacency(self):
+		return sparse.csr_matrix((np.ones(len(self.indices), dtype = np.int8), self.indices, self.indptr),
+								shape = (len(self.nodes), len(self.nodes)))
+
+	def neighbors(self, node):
+		return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+	#Array of an attribute by graph attribute name ('DV', 'POP'...) or array name ('dv', 'pop'...)
+	def attribute(self, name):
+		slot = ATTRIBUTE_SLOTS.get(name, str(name).lower())
+		values = getattr(self, slot) if slot in DATA_SLOTS else None
+		if values is None:
+			raise KeyError('graph data has no attribute ' + str(name))
+		return values
+
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		print('usage: python graph_data.py demographic_data.csv adjacency.csv')
+		sys.exit(1)
+	data = GraphData.from_csv(sys.argv[1], sys.argv[2])
+	print('%d nodes, %d edges, attributes: %s' % (len(data), len(data.indices) // 2,
+			', '.join(slot for slot in DATA_SLOTS if getattr(data, slot) is not None)))
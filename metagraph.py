@@ -0,0 +1,145 @@
+import numpy as np
+import scipy.sparse as sparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from benchmark_calculations import canonical_array
+from contiguity import read_adjacency_csv, connected_sets, flip_proposals, ContiguityChecker
+from ensemble_format import load_ensemble
+from enumeration import load_enumeration_csv
+from plan_index import PlanIndex
+
+
+#This file builds the single flip metagraph of an ensemble of plans (usually a full enumeration): plans are
+#neighbors when flipping one node into an adjacent district turns one into the other while keeping every
+#district contiguous and non-empty. This replaces old/metagraph_enum_neighbors.py, which stored a dense
+#num_plans x num_plans matrix. Here the metagraph is a scipy CSR matrix where metagraph[x, y] is the number of
+#single flip proposals (a cut edge and the endpoint flipped across it) that move plan x to plan y, so
+#metagraph.astype(bool) is the plain adjacency and metagraph.getnnz(axis = 1) the metagraph degrees. The same
+#builder gives the metagraph of reversible chunk flip when max_chunk is more than 1.
+#Neighbors are found by generating every flip of a plan, checking contiguity, canonicalizing and looking the
+#result up in a PlanIndex of the ensemble. Flips to plans outside the ensemble (for example plans breaking a
+#population constraint the enumeration applied) are left out.
+#
+#Functions:
+#
+#chunk_moves : the chunks of nodes a reversible chunk flip can move along with a flipped node
+#build_metagraph : sparse metagraph of an array of canonical plans, optionally built across processes
+#save_metagraph : saves a metagraph as a compressed .npz file
+#load_metagraph : loads a metagraph saved with save_metagraph
+#load_plans : plans from an ensemble file (.ens) or an enumeration csv (one plan per column)
+#
+#From the command line, python metagraph.py plans.ens adjacency.csv metagraph.npz builds and saves a metagraph
+
+
+#state of each worker process, set up once by init_worker
+worker_state = dict()
+
+
+def init_worker(plans, adjacency, max_chunk = 1, chunk_decay = 0.5):
+	worker_state['plans'] = plans
+	worker_state['index'] = PlanIndex(plans)
+	worker_state['checker'] = ContiguityChecker(adjacency)
+	worker_state['max_chunk'] = max_chunk
+	worker_state['chunk_decay'] = chunk_decay
+
+
+#Chunks that can move along with node in a chunk flip of plan, as (chunks, probabilities) for the valid ones.
+#A chunk is a connected set of up to max_chunk nodes of node's district containing node, chosen with
+#probability proportional to chunk_decay ** (size - 1). With max_chunk = 1 the only chunk is the node itself
+def chunk_moves(plan, node, checker, max_chunk, chunk_decay):
+	chunks = connected_sets(checker.neighbors, plan, node, max_chunk)
+	weights = chunk_decay ** (np.array([len(chunk) for chunk in chunks]) - 1.0)
+	probabilities = weights / weights.sum()
+	district_size = int(np.count_nonzero(plan == plan[node]))
+	valid = [i for i, chunk in enumerate(chunks) if checker.can_remove_set(plan, chunk, district_size)]
+	return [chunks[i] for i in valid], probabilities[valid]
+
+
+#Metagraph edges (rows, cols, weights) out of plans start to stop, run in the worker processes
+def block_edges(start, stop):
+	plans = np.asarray(worker_state['plans'][start:stop], dtype = np.intp)
+	checker = worker_state['checker']
+	max_chunk, chunk_decay = worker_state['max_chunk'], worker_state['chunk_decay']
+	rows = list()
+	flipped = list()
+	weights = list()
+	for row, plan in enumerate(plans):
+		if max_chunk == 1:
+			#single flips are checked all at once from the articulation points of the plan
+			nodes, districts, proposals = checker.valid_flips(plan)
+			new_plans = np.repeat(plan[np.newaxis], len(nodes), axis = 0)
+			new_plans[np.arange(len(nodes)), nodes] = districts
+			flipped.append(new_plans)
+			rows.append(np.full(len(nodes), start + row))
+			weights.append(proposals.astype(float))
+			continue
+		nodes, districts, proposals = flip_proposals(plan, checker.heads, checker.tails)
+		moves = {node : chunk_moves(plan, node, checker, max_chunk, chunk_decay) for node in set(nodes.tolist())}
+		for node, district, count in zip(nodes.tolist(), districts.tolist(), proposals.tolist()):
+			chunks, probabilities = moves[node]
+			new_plans = np.repeat(plan[np.newaxis], len(chunks), axis = 0)
+			for i, chunk in enumerate(chunks):
+				new_plans[i, list(chunk)] = district
+			flipped.append(new_plans)
+			rows.append(np.full(len(chunks), start + row))
+			weights.append(count * probabilities)
+	if not flipped:
+		return np.zeros(0, dtype = np.intp), np.zeros(0, dtype = np.intp), np.zeros(0)
+	cols = worker_state['index'].lookup(canonical_array(np.concatenate(flipped)), strict = False)
+	rows = np.concatenate(rows)
+	weights = np.concatenate(weights)
+	found = cols >= 0
+	return rows[found], cols[found], weights[found]
+
+
+#Builds the metagraph of plans (an array of distinct plans, canonicalized on the way in) over the graph with
+#the given adjacency matrix. Blocks of block_size plans are handed to processes worker processes (None for one
+#per CPU, 1 to build in this process). Worker processes are only started on request, as they need the calling
+#script to have an if __name__ == '__main__' guard on platforms that spawn them
+#With max_chunk > 1 the metagraph is that of reversible chunk flip instead: each proposal moves a chunk of up to
+#max_chunk connected nodes (see chunk_moves), and entries are the expected number of proposals (a float)
+#moving plan x to plan y. Entries of different chunks leading to the same plan are added up
+def build_metagraph(plans, adjacency, processes = 1, block_size = 1000, max_chunk = 1, chunk_decay = 0.5):
+	plans = canonical_array(np.asarray(plans))
+	blocks = [(start, min(start + block_size, len(plans))) for start in range(0, len(plans), block_size)]
+	worker_args = (plans, adjacency, max_chunk, chunk_decay)
+	if processes == 1:
+		init_worker(*worker_args)
+		edges = [block_edges(start, stop) for (start, stop) in blocks]
+	else:
+		with ProcessPoolExecutor(max_workers = processes, initializer = init_worker,
+								initargs = worker_args) as executor:
+			edges = list(executor.map(block_edges, *zip(*blocks))) if blocks else list()
+	dtype = np.int32 if max_chunk == 1 else float
+	if not edges:
+		return sparse.csr_matrix((len(plans), len(plans)), dtype = dtype)
+	rows, cols, weights = (np.concatenate(parts) for parts in zip(*edges))
+	metagraph = sparse.csr_matrix((weights, (rows, cols)), shape = (len(plans), len(plans)))
+	if max_chunk == 1:
+		metagraph.data = np.rint(metagraph.data)
+	return metagraph.astype(dtype)
+
+
+def save_metagraph(path, metagraph):
+	sparse.save_npz(path, sparse.csr_matrix(metagraph), compressed = True)
+
+
+def load_metagraph(path):
+	return sparse.load_npz(path).tocsr()
+
+
+#Loads plans from an ensemble file (.ens) or from an enumeration csv in the format of the enumeration data,
+#where each column is a plan
+def load_plans(path):
+	if path.endswith('.ens'):
+		return load_ensemble(path)
+	return load_enumeration_csv(path)
+
+
+if __name__ == '__main__':
+	if len(sys.argv) != 4:
+		print('usage: python metagraph.py plans.ens adjacency.csv metagraph.npz')
+		sys.exit(1)
+	metagraph = build_metagraph(load_plans(sys.argv[1]), read_adjacency_csv(sys.argv[2]), processes = None)
+	save_metagraph(sys.argv[3], metagraph)
+	print('metagraph of %d plans with %d edges' % (metagraph.shape[0], metagraph.nnz // 2))
@@ -0,0 +1,154 @@
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as splinalg
+import sys
+from contiguity import read_adjacency_csv
+from feature_store import hist_bin_indices
+from metagraph import load_metagraph, load_plans
+
+
+#This file computes exact mixing properties of the proposal methods described in the README on a fully
+#enumerated ensemble, from the sparse transition matrix of each proposal over the metagraph (see metagraph.py)
+#instead of from sampled chains. Plans are numbered by their row in the enumeration. Invalid proposals are
+#drawn again, as in RunDMCMC, so each proposal moves to plan y with probability proportional to the metagraph
+#entry m(x, y), and the lazy variants stay put with the rest of the probability:
+#	not lazy : P(x, y) = m(x, y) / m(x) where m(x) is the row sum of the metagraph
+#	wes lazy : moves with probability c(x) / c_max, where c(x) is the number of cut edges of plan x (the
+#			   approximate degree), then as not lazy
+#	real degree lazy : P(x, y) = 1 / max degree for every distinct neighbor y, so the stationary
+#			   distribution is uniform
+#	chunk flip : as not lazy, on the metagraph built with max_chunk > 1
+#
+#Functions:
+#
+#cut_edge_counts : number of cut edges of every plan
+#transition_matrix : sparse transition matrix of a proposal method
+#stationary_distribution : stationary distribution of a transition matrix
+#spectral_gap : spectral gap (1 - second largest eigenvalue modulus) and relaxation time
+#distribution_steps : distributions of the chain after 0, 1, 2... steps from a starting plan
+#tv_distances : exact total variation distance to the uniform (or any) distribution after each step
+#expected_hist_errors : the running histogram error get_benchmark_data measures, in expectation
+#
+#From the command line, python mixing.py plans.ens adjacency.csv metagraph.npz prints the spectral gap of
+#each single flip proposal
+
+
+PROPOSALS = ('not lazy', 'wes lazy', 'real degree lazy', 'chunk flip')
+
+
+#Number of edges between two districts for every plan in a (num_plans x num_nodes) array
+def cut_edge_counts(plans, adjacency, chunk_size = 100000):
+	edges = sparse.triu(sparse.coo_matrix(adjacency), k = 1)
+	counts = np.empty(len(plans), dtype = np.intp)
+	for start in range(0, len(plans), chunk_size):
+		chunk = np.asarray(plans[start:start + chunk_size])
+		counts[start:start + chunk_size] = (chunk[:, edges.row] != chunk[:, edges.col]).sum(axis = 1)
+	return counts
+
+
+def row_normalized(matrix):
+	matrix = sparse.csr_matrix(matrix, dtype = float)
+	totals = np.asarray(matrix.sum(axis = 1)).ravel()
+	scale = np.divide(1.0, totals, out = np.zeros(len(totals)), where = totals > 0)
+	return sparse.diags(scale) @ matrix
+
+
+#Transition matrix (scipy CSR, rows summing to 1) of proposal over a metagraph. wes lazy also needs the plans
+#and the adjacency matrix of the graph to count cut edges. Plans without any valid move stay put
+def transition_matrix(metagraph, proposal = 'not lazy', plans = None, adjacency = None):
+	if proposal not in PROPOSALS:
+		raise ValueError('unknown proposal: ' + str(proposal))
+	metagraph = sparse.csr_matrix(metagraph)
+	if proposal in ('not lazy', 'chunk flip'):
+		moves = row_normalized(metagraph)
+	elif proposal == 'wes lazy':
+		if plans is None or adjacency is None:
+			raise ValueError('wes lazy needs plans and adjacency')
+		cut_edges = cut_edge_counts(plans, adjacency)
+		moves = sparse.diags(cut_edges / cut_edges.max()) @ row_normalized(metagraph)
+	else:
+		neighbors = (metagraph > 0).astype(float)
+		moves = neighbors / neighbors.sum(axis = 1).max()
+	stay = 1 - np.asarray(moves.sum(axis = 1)).ravel()
+	return sparse.csr_matrix(moves + sparse.diags(np.clip(stay, 0, 1)))
+
+
+#Stationary distribution of a transition matrix, from the eigenvector of its transpose with eigenvalue 1
+def stationary_distribution(transitions):
+	transitions = sparse.csr_matrix(transitions)
+	if transitions.shape[0] < 3:
+		values, vectors = np.linalg.eig(transitions.T.toarray())
+	else:
+		values, vectors = splinalg.eigs(transitions.T, k = 1, which = 'LR', v0 = np.ones(transitions.shape[0]))
+	vector = np.real(vectors[:, np.argmax(np.real(values))])
+	return np.abs(vector) / np.abs(vector).sum()
+
+
+#Outputs (gap, relaxation time) where gap is 1 minus the second largest eigenvalue modulus of the transition
+#matrix, found with a sparse eigensolver. A gap of 0 means the chain is periodic or not connected
+def spectral_gap(transitions):
+	transitions = sparse.csr_matrix(transitions)
+	if transitions.shape[0] < 4:
+		values = np.linalg.eigvals(transitions.toarray())
+	else:
+		values = splinalg.eigs(transitions, k = 2, which = 'LM', v0 = np.ones(transitions.shape[0]),
+								return_eigenvectors = False)
+	moduli = np.sort(np.abs(values))[::-1]
+	gap = max(0.0, 1 - moduli[1]) if len(moduli) > 1 else 1.0
+	return gap, (1 / gap if gap > 0 else np.inf)
+
+
+#Yields the distribution of the chain after 0, 1, ... steps steps, starting from plan start (or from a given
+#distribution), each step being one sparse matrix-vector product
+def distribution_steps(transitions, steps, start = 0):
+	transitions_t = sparse.csr_matrix(transitions).T.tocsr()
+	if np.isscalar(start):
+		distribution = np.zeros(transitions_t.shape[0])
+		distribution[start] = 1
+	else:
+		distribution = np.array(start, dtype = float)
+	yield distribution
+	for step in range(steps):
+		distribution = transitions_t @ distribution
+		yield distribution
+
+
+#Total variation distance between the chain's distribution after 0 to steps steps from start and target
+#(uniform over all plans by default), outputs an array of length steps + 1
+def tv_distances(transitions, steps, start = 0, target = None):
+	if target is None:
+		target = np.full(transitions.shape[0], 1 / transitions.shape[0])
+	return np.array([np.abs(distribution - target).sum() / 2
+					for distribution in distribution_steps(transitions, steps, start)])
+
+
+#Expected version of the running histogram errors of plots/processing.get_benchmark_data for a chain started at
+#start: the L1 distance between true_hist and the density histogram of feature_values weighted by the average
+#distribution over the first i steps, for every i in checkpoints (i >= 1). Values are binned with
+#feature_store.hist_bin_indices, as the measured errors are
+def expected_hist_errors(transitions, start, feature_values, bin_edges, true_hist, checkpoints):
+	checkpoints = np.asarray(checkpoints)
+	num_bins = len(bin_edges) - 1
+	bins = hist_bin_indices(feature_values, bin_edges)
+	in_range = bins >= 0
+	widths = np.diff(bin_edges)
+	errors = np.empty(len(checkpoints))
+	visits = np.zeros(transitions.shape[0])
+	for step, distribution in enumerate(distribution_steps(transitions, int(checkpoints.max()) - 1, start)):
+		visits += distribution
+		for i in np.flatnonzero(checkpoints == step + 1):
+			mass = np.bincount(bins[in_range], weights = visits[in_range], minlength = num_bins)
+			errors[i] = np.abs(mass / mass.sum() / widths - true_hist).sum()
+	return errors
+
+
+if __name__ == '__main__':
+	if len(sys.argv) != 4:
+		print('usage: python mixing.py plans.ens adjacency.csv metagraph.npz')
+		sys.exit(1)
+	plans = load_plans(sys.argv[1])
+	adjacency = read_adjacency_csv(sys.argv[2])
+	metagraph = load_metagraph(sys.argv[3])
+	for proposal in PROPOSALS[:3]:
+		gap, relaxation_time = spectral_gap(transition_matrix(metagraph, proposal, plans, adjacency))
+		print('%s: spectral gap %g, relaxation time %g' % (proposal, gap, relaxation_time))
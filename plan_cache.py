@@ -0,0 +1,219 @@
+import numpy as np
+import hashlib
+import functools
+from collections import OrderedDict
+import benchmark_calculations
+from benchmark_calculations import canonical_array, plan_chunks
+from plan_index import plan_hashes
+
+
+#This file memoizes the per-plan results of the scoring and distance functions of benchmark_calculations.py, for
+#chains that revisit the same plans over and over (lazy proposals stay put by design). Results are cached per plan
+#under the 128 bit hash of its canonical form (see plan_index.plan_hashes), the function and its other
+#arguments, and the least recently used ones are evicted once the cache holds more than max_entries results or
+#max_bytes bytes. Plans are handled in chunks: each chunk is hashed at once, repeats within the chunk are
+#looked up once, and all the plans missing from the cache are computed together in one call of the function.
+#Memoizing is opt-in, the functions of benchmark_calculations.py are unchanged. It pays off for the distance
+#functions (a matching per plan and tower) on chains with many repeats; the partisan scores are a few bincounts
+#over the plans, about as cheap as hashing them, so on small graphs they are faster left unmemoized.
+#
+#Functions:
+#
+#PlanCache : bounded LRU cache of per-plan results, with hit, miss and eviction counts
+#memoize_benchmarks : memoized versions of the scoring and distance functions of benchmark_calculations.py
+
+
+#rough size of a cache entry besides its value: the key tuple and the ordered dict's bookkeeping
+ENTRY_OVERHEAD = 200
+
+#functions of (graph, partitions, ...) outputting one result per partition, which memoize_benchmarks wraps
+MEMOIZABLE = ('eff_gap', 'dem_seats', 'rep_seats', 'mean_median', 'mean_thirdian', 'score_ensemble',
+			'hamming_dist', 'entropy_dist', 'hamming_distances', 'entropy_distances', 'tower_distances')
+
+
+#Hashable stand-in for an argument of a memoized function. Arrays (and lists of plans) are keyed by their
+#contents, graphs and other objects by identity: they are kept in objects so their id can't be reused by another
+#object while the cache lives, but a graph whose attributes change has to be given a new cache
+def argument_key(value, objects):
+	if value is None or isinstance(value, (bool, int, float, str, bytes)):
+		return value
+	if isinstance(value, (tuple, list)) and all(np.isscalar(item) for item in value):
+		return tuple(value)
+	if isinstance(value, (np.ndarray, tuple, list)):
+		array = np.ascontiguousarray(value)
+		if array.dtype != object:
+			return (array.shape, array.dtype.str, hashlib.sha256(array.tobytes()).hexdigest())
+	objects[id(value)] = value
+	return ('id', id(value))
+
+
+def value_size(value):
+	if isinstance(value, np.ndarray):
+		return value.nbytes
+	if isinstance(value, (tuple, list)):
+		return sum(value_size(item) for item in value)
+	return 8
+
+
+#Splits the output of a function over n partitions into one value per partition, a tuple of values for
+#functions outputting several arrays (like tower_distances). Array rows are copied so they don't keep the whole
+#output alive
+def split_output(output, n):
+	if isinstance(output, tuple):
+		return list(zip(*[split_output(part, n) if part is not None else [None] * n for part in output]))
+	if isinstance(output, np.ndarray):
+		return [output[i].copy() for i in range(n)]
+	return list(output)
+
+
+#Output of no partitions, with the type (and dtype) of output
+def empty_output(output):
+	if isinstance(output, tuple):
+		return tuple(empty_output(part) if part is not None else None for part in output)
+	if isinstance(output, np.ndarray):
+		return output[:0].copy()
+	return list()
+
+
+#Output over n distinct plans, of the type of template (see empty_output), from the output of the function over
+#the plans at positions missing and the cached values of the others, given as (position, value) pairs
+def fill_output(template, n, missing, output, cached):
+	if isinstance(template, tuple):
+		return tuple(fill_output(part, n, missing, output[k] if missing else None,
+								[(i, value[k]) for (i, value) in cached]) if part is not None else None
+					for (k, part) in enumerate(template))
+	if isinstance(template, np.ndarray):
+		filled = np.empty((n,) + template.shape[1:], dtype = template.dtype)
+		if missing:
+			filled[missing] = output
+		for (i, value) in cached:
+			filled[i] = value
+		return filled
+	filled = [None] * n
+	for (j, i) in enumerate(missing):
+		filled[i] = output[j]
+	for (i, value) in cached:
+		filled[i] = value
+	return filled
+
+
+#Rows of an output at positions
+def take_output(output, positions):
+	if isinstance(output, tuple):
+		return tuple(take_output(part, positions) if part is not None else None for part in output)
+	if isinstance(output, np.ndarray):
+		return output[positions]
+	return [output[i] for i in positions.tolist()]
+
+
+#Joins the outputs of consecutive chunks of partitions
+def join_outputs(outputs, template):
+	if isinstance(template, tuple):
+		return tuple(join_outputs([output[i] for output in outputs], part) if part is not None else None
+					for (i, part) in enumerate(template))
+	if isinstance(template, np.ndarray):
+		return np.concatenate(outputs)
+	return [value for output in outputs for value in output]
+
+
+#Ex: cache = PlanCache(max_bytes = 2**28)
+#	eff_gap = cache.memoize(benchmark_calculations.eff_gap)
+#	gaps = eff_gap(graph, chain_plans)             #same output as benchmark_calculations.eff_gap
+#	cache.stats()                                  #{'hits' : ..., 'misses' : ..., 'evictions' : ...}
+class PlanCache:
+
+	def __init__(self, max_entries = None, max_bytes = None, chunk_size = 100000):
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.chunk_size = chunk_size
+		self.entries = OrderedDict()
+		#empty output of each memoized function and arguments, telling fill_output the output type
+		self.templates = dict()
+		#objects keyed by identity, see argument_key
+		self.objects = dict()
+		self.num_bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions,
+				'entries' : len(self.entries), 'bytes' : self.num_bytes,
+				'hit_rate' : self.hits / lookups if lookups else 0.0}
+
+	def clear(self):
+		self.entries.clear()
+		self.templates.clear()
+		self.objects.clear()
+		self.num_bytes = 0
+
+	def add(self, key, value):
+		size = value_size(value) + ENTRY_OVERHEAD
+		if key in self.entries:
+			self.num_bytes -= self.entries.pop(key)[1]
+		self.entries[key] = (value, size)
+		self.num_bytes += size
+		while self.entries and ((self.max_entries is not None and len(self.entries) > self.max_entries) or
+								(self.max_bytes is not None and self.num_bytes > self.max_bytes)):
+			self.num_bytes -= self.entries.popitem(last = False)[1][1]
+			self.evictions += 1
+
+	#Output of compute (a function of a (num_plans x num_nodes) array outputting one result per plan) for a chunk
+	#of plans, using and filling the cache under key
+	def chunk_output(self, key, chunk, compute):
+		chunk = np.asarray(chunk)
+		hashes = plan_hashes(canonical_array(chunk), bits = 128)
+		unique_hashes, first, inverse = np.unique(hashes, axis = 0, return_index = True, return_inverse = True)
+		unique_hashes = [(key, high, low) for (high, low) in unique_hashes.tolist()]
+		missing = list()
+		cached = list()
+		for (i, entry_key) in enumerate(unique_hashes):
+			entry = self.entries.get(entry_key)
+			if entry is None:
+				missing.append(i)
+			else:
+				self.entries.move_to_end(entry_key)
+				cached.append((i, entry[0]))
+		self.misses += len(missing)
+		self.hits += len(chunk) - len(missing)
+		output = None
+		if missing:
+			output = compute(chunk[first[missing]])
+			self.templates[key] = empty_output(output)
+			for (i, value) in zip(missing, split_output(output, len(missing))):
+				self.add(unique_hashes[i], value)
+		unique_output = fill_output(self.templates[key], len(unique_hashes), missing, output, cached)
+		return take_output(unique_output, inverse.ravel())
+
+	#Memoized version of function, a function of (graph, partitions, ...) outputting one result per partition
+	#as a list, an array or a tuple of arrays. Results are cached per plan under the function, graph and other
+	#arguments. Partitions are anything plan_chunks accepts
+	def memoize(self, function):
+		@functools.wraps(function)
+		def memoized(graph, partitions, *args, **kwargs):
+			key = (function.__module__, function.__name__, argument_key(graph, self.objects),
+					tuple(argument_key(arg, self.objects) for arg in args),
+					tuple((name, argument_key(value, self.objects)) for (name, value) in sorted(kwargs.items())))
+			outputs = list()
+			for chunk in plan_chunks(partitions, self.chunk_size):
+				outputs.append(self.chunk_output(key, chunk, lambda plans: function(graph, plans, *args, **kwargs)))
+			if not outputs:
+				return function(graph, partitions, *args, **kwargs)
+			return join_outputs(outputs, self.templates[key])
+		memoized.cache = self
+		return memoized
+
+
+#Memoized versions of the functions of MEMOIZABLE sharing one cache (a PlanCache, or a new one bounded by
+#max_entries and max_bytes), as a dict by function name
+#Ex: benchmarks = memoize_benchmarks(max_entries = 10**6)
+#	scores = benchmarks['score_ensemble'](graph, chain_plans, ['eff_gap', 'mean_median'])
+#	hamming = benchmarks['hamming_distances'](graph, chain_plans, towers)
+def memoize_benchmarks(cache = None, max_entries = None, max_bytes = None):
+	if cache is None:
+		cache = PlanCache(max_entries, max_bytes)
+	return {name : cache.memoize(getattr(benchmark_calculations, name)) for name in MEMOIZABLE}
@@ -0,0 +1,139 @@
+import numpy as np
+
+
+#This file gives canonical form plans compact integer IDs, so that counting visits, finding distinct plans and
+#looking up precomputed values become array operations (np.unique, np.bincount, indexing) on ID arrays instead of
+#dict and set operations keyed on full plan tuples.
+#
+#Plans are hashed by a 64 bit multilinear hash of their labels (each node's label times a fixed random odd
+#multiplier, summed mod 2**64) followed by the MurmurHash3 finalizer to mix the bits. The multipliers are seeded,
+#so hashes are the same from run to run and can be saved. Collisions are possible in principle (around 1 in 2**57
+#for a pair of plans), so PlanIndex and plan_ids compare the actual plans behind every match.
+#
+#Functions:
+#
+#plan_hashes : 64 bit (or 128 bit) hash of every plan in an array
+#PlanIndex : perfect index of a fixed set of plans, like a full enumeration, mapping each plan to its position
+#plan_ids : numbers the distinct plans of an ensemble in order of first appearance, without an index
+#plan_frequencies : number of visits to each plan ID
+#first_visits : marks the steps where a plan is visited for the first time
+
+
+HASH_SEED = 20180724
+HASH_CHUNK_SIZE = 2**22
+
+
+def hash_multipliers(num_nodes, lanes = 1):
+	rng = np.random.default_rng(HASH_SEED)
+	return rng.integers(0, 2**64, size = (lanes, num_nodes), dtype = np.uint64) | np.uint64(1)
+
+
+#MurmurHash3 64 bit finalizer, applied in place
+def mix64(hashes):
+	hashes ^= hashes >> np.uint64(33)
+	hashes *= np.uint64(0xff51afd7ed558ccd)
+	hashes ^= hashes >> np.uint64(33)
+	hashes *= np.uint64(0xc4ceb9fe1a85ec53)
+	hashes ^= hashes >> np.uint64(33)
+	return hashes
+
+
+#Hashes every row of a (num_plans x num_nodes) array of canonical form plans (or a single plan). Outputs a uint64
+#array of length num_plans, or (num_plans x 2) for bits = 128. Rows are hashed in blocks to bound the temporary
+#memory used
+def plan_hashes(plans, bits = 64):
+	plans = np.asarray(plans)
+	single = plans.ndim == 1
+	if single:
+		plans = plans[np.newaxis]
+	lanes = bits // 64
+	multipliers = hash_multipliers(plans.shape[1], lanes)
+	hashes = np.empty((len(plans), lanes), dtype = np.uint64)
+	block = max(1, HASH_CHUNK_SIZE // max(1, plans.shape[1]))
+	for start in range(0, len(plans), block):
+		labels = plans[start:start + block].astype(np.uint64)
+		for lane in range(lanes):
+			hashes[start:start + block, lane] = mix64((labels * multipliers[lane]).sum(axis = 1, dtype = np.uint64))
+	if lanes == 1:
+		hashes = hashes[:, 0]
+	return hashes[0] if single else hashes
+
+
+#Index of a fixed array of distinct canonical form plans (for example a full enumeration). The ID of a plan is its
+#row in that array, so values precomputed for every plan (features, degrees...) are looked up by indexing
+#Ex: index = PlanIndex(all_plans)
+#	ids = index.lookup(sampled_plans)
+#	features = feature_values[ids]
+class PlanIndex:
+
+	def __init__(self, plans):
+		self.plans = np.asarray(plans)
+		hashes = plan_hashes(self.plans)
+		self.order = np.argsort(hashes, kind = 'stable')
+		self.sorted_hashes = hashes[self.order]
+		if len(hashes) > 1 and (np.diff(self.sorted_hashes) == 0).any():
+			raise ValueError('index plans are not distinct (or two of them share a hash)')
+
+	#Builds an index from arrays computed by another PlanIndex, skipping the hashing and sort
+	@classmethod
+	def from_sorted(cls, plans, sorted_hashes, order):
+		index = cls.__new__(cls)
+		index.plans = plans
+		index.sorted_hashes = sorted_hashes
+		index.order = order
+		return index
+
+	def __len__(self):
+		return len(self.plans)
+
+	def __getitem__(self, plan_id):
+		return self.plans[plan_id]
+
+	#IDs of plans (a (num_plans x num_nodes) array or a single plan). Plans have to be in canonical form.
+	#Plans not in the index raise a KeyError, or get ID -1 when strict is False.
+	#With verify, the plans are compared with the indexed ones so a hash collision can't give a wrong ID
+	def lookup(self, plans, strict = True, verify = True):
+		plans = np.asarray(plans)
+		single = plans.ndim == 1
+		if single:
+			plans = plans[np.newaxis]
+		hashes = plan_hashes(plans)
+		positions = np.minimum(np.searchsorted(self.sorted_hashes, hashes), len(self.sorted_hashes) - 1)
+		found = self.sorted_hashes[positions] == hashes
+		ids = np.where(found, self.order[positions], -1)
+		if verify and found.any():
+			matched = np.flatnonzero(found)
+			ids[matched[(self.plans[ids[matched]] != plans[matched]).any(axis = 1)]] = -1
+		if strict and (ids < 0).any():
+			missing = plans[np.flatnonzero(ids < 0)[0]]
+			raise KeyError('plan not in index: ' + str(tuple(missing.tolist())))
+		return ids[0] if single else ids
+
+
+#Numbers the distinct plans in an ensemble 0, 1, 2... in order of first appearance, for ensembles without a full
+#enumeration to index against. Outputs (ids, unique_plans) where unique_plans[ids[i]] is plans[i]
+def plan_ids(plans):
+	plans = np.asarray(plans)
+	hashes = plan_hashes(plans)
+	unique_hashes, first, inverse = np.unique(hashes, return_index = True, return_inverse = True)
+	#renumber from sorted hash order to order of first appearance
+	by_appearance = np.argsort(first, kind = 'stable')
+	renumber = np.empty_like(by_appearance)
+	renumber[by_appearance] = np.arange(len(by_appearance))
+	ids = renumber[inverse.ravel()]
+	unique_plans = plans[first[by_appearance]]
+	if (unique_plans[ids] != plans).any():
+		raise ValueError('two different plans share a hash')
+	return ids, unique_plans
+
+
+#Number of visits to each plan ID, with num_plans entries (so unvisited plans count 0)
+def plan_frequencies(ids, num_plans = None):
+	return np.bincount(ids, minlength = num_plans if num_plans is not None else 0)
+
+
+#Boolean array marking the steps that visit a plan for the first time
+def first_visits(ids):
+	first = np.zeros(len(ids), dtype = bool)
+	first[np.unique(ids, return_index = True)[1]] = True
+	return first
@@ -5,54 +5,79 @@ Created on Tue Jul 24 14:56:26 2018
 
 This is the main script for producing benchmark plots, divided into labeled sections. Several sampled ensembles are compared to a fully enumerated ensemble according to a chosen feature.
 """
+import os
+import sys
 import numpy as np
-import pickle
-from processing import load_plans, get_benchmark_data
+
+# the array engines live in the top level modules of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from feature_store import FeatureStore
+from graph_data import GraphData
+from plan_index import PlanIndex
+from processing import load_ensemble_plans
+from pipeline import run_benchmarks
 from plots import plot_exploration_benchmarks, plot_mixing_benchmarks
 from utils import entropy, get_dem_seat_share
     
 #%% settings
+# ensembles can be pickles of canonical form tuples or ensemble files (.ens), which load much faster;
+# convert a pickle with: python ensemble_format.py ensemble.p ensemble.ens
+# a chain can also be simulated instead of loaded, e.g. 'not lazy': partial(simulate_plans, adjacency, initial_plan, 1000000)
+# with functools.partial and chain_sim.simulate_plans
 graph_name = '25 Node Florida Precinct Graph'
 demographic_data_path = 'data/demographic_data.csv'
+adjacency_path = 'data/fifield_ FL_adjacency_list.csv'
 full_ensemble_path = 'data/full_ensemble.p'
+# feature values of every plan of the full ensemble are kept here and only computed when missing,
+# or when the full ensemble or the demographic data changed
+feature_store_path = 'data/full_ensemble_features'
 sampled_ensemble_paths = {
     'not lazy': 'data/sampled_ensembles/single_flip/not_lazy_1mill.p',
     'wes lazy': 'data/sampled_ensembles/single_flip/wes_lazy_1mill.p',
     'real degree lazy': 'data/sampled_ensembles/single_flip/real_degree_1mill.p'
 }
-feature = entropy
+# feature is a metric name of benchmark_calculations.ENSEMBLE_METRICS ('entropy', 'seat_share', 'eff_gap'...)
+# or a function of (plan, dems, reps) like entropy or get_dem_seat_share
+feature = 'entropy'
 feature_name = 'Partition Entropy'
 feature_axis_label = 'Entropy'
 # the following settings are really the only manual part of the plotting process
 # feature_hist_bins is the bins argument for the histogram function, fiddle around with this
 # iterations_step is the number of iterations skipped between points plotted on running error and exploration charts
-# (computing at each iteration is unnecessary and slow)
+# (the curves take one pass over the chain whatever the step, this only thins out the plotted points)
 feature_hist_bins = np.linspace(-75,-50,15)
-iterations_step = 100000
-
-#%% load full ensemble and demographic data
-with open(full_ensemble_path, 'rb') as f:
-    all_plans = pickle.load(f)
+iterations_step = 1000
+# number of worker processes the sampled ensembles are benchmarked on (None for one per CPU)
+processes = None
+# chains too long to load (.ens or chain_codec .npz files) can be streamed from disk in blocks of
+# chunk_size steps, e.g. 10**6, so memory doesn't grow with the chain; None loads each ensemble whole
+chunk_size = None
 
-with open(demographic_data_path, 'rb') as f:
-    demographic_data = np.loadtxt(f, delimiter=',', skiprows=1)
-dems = demographic_data[:,1]
-reps = demographic_data[:,2]
+# the guard keeps worker processes from rerunning the script when they import it
+if __name__ == '__main__':
+    #%% load full ensemble and demographic data
+    all_plans = load_ensemble_plans(full_ensemble_path)
 
-#%% load sampled ensemble plans
-plans_by_ensemble = load_plans(sampled_ensemble_paths)
+    graph_data = GraphData.from_csv(demographic_data_path, adjacency_path)
+    dems = graph_data.dv
+    reps = graph_data.rv
 
-#%% compute feature for all plans
-feature_table = dict([(plan, feature(plan, dems, reps)) for plan in all_plans])
+    #%% look up (or compute once) the feature of all plans, index-paired with the plan IDs of plan_index
+    plan_index = PlanIndex(all_plans)
+    feature_store = FeatureStore(feature_store_path, plan_index.plans, dems, reps)
+    feature_values = feature_store.column(feature)
 
-#%% compute data to plot
-benchmark_data = get_benchmark_data(plans_by_ensemble,
-                                    feature_table,
+    #%% load sampled ensembles and compute data to plot, one process per ensemble
+    benchmark_data = run_benchmarks(sampled_ensemble_paths,
+                                    plan_index,
+                                    feature_values,
                                     feature_hist_bins,
-                                    iterations_step, verbose=True)
+                                    iterations_step,
+                                    processes=processes, verbose=True,
+                                    chunk_size=chunk_size)
 
-#%% create exploration plots
-plot_exploration_benchmarks(benchmark_data, graph_name,
-                            feature_name, feature_axis_label)
-plot_mixing_benchmarks(benchmark_data, graph_name,
-                       feature_name, feature_axis_label)
\ No newline at end of file
+    #%% create exploration plots
+    plot_exploration_benchmarks(benchmark_data, graph_name,
+                                feature_name, feature_axis_label)
+    plot_mixing_benchmarks(benchmark_data, graph_name,
+                           feature_name, feature_axis_label)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the benchmark computations of several sampled ensembles in parallel,
+one ensemble per worker process. Each worker loads and canonicalizes its
+ensemble, looks up the plan IDs and features and computes the curves, then
+sends back only the benchmark data. The full ensemble index and the feature
+table are put in shared memory once instead of being pickled to every worker.
+Ensembles on graphs too large to enumerate are summarized by sketches instead
+(run_sketched_benchmarks), which are merged across the workers.
+"""
+import os
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# the array engines live in the top level modules of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from plan_index import PlanIndex
+from sketches import merge_sketches
+from processing import load_ensemble_plans, iter_ensemble_chunks, get_ensemble_benchmark, \
+    get_streamed_benchmark, get_sketched_benchmark
+
+# arrays attached from shared memory, set up once in each worker
+worker_arrays = {}
+
+def share_array(array, shared_blocks):
+    # copies array into a new shared memory block, outputs what a worker
+    # needs to attach it
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    shared_blocks.append(block)
+    np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+    return (block.name, array.shape, array.dtype.str)
+
+def attach_arrays(specs):
+    # worker initializer, the blocks are kept open for the worker's lifetime
+    for (key, (name, shape, dtype)) in specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        worker_arrays[key] = (block, np.ndarray(shape, dtype, buffer=block.buf))
+
+def benchmark_ensemble(ensemble, path, bin_edges, true_hist, iterations_step,
+                       chunk_size=None):
+    arrays = {key: array for (key, (block, array)) in worker_arrays.items()}
+    plan_index = PlanIndex.from_sorted(arrays['plans'],
+                                       arrays['sorted_hashes'],
+                                       arrays['order'])
+    if chunk_size is not None:
+        chunks = iter_ensemble_chunks(path, chunk_size)
+        return ensemble, get_streamed_benchmark(chunks, plan_index,
+                                                arrays['feature_values'],
+                                                bin_edges, true_hist,
+                                                iterations_step)
+    plans = load_ensemble_plans(path)
+    return ensemble, get_ensemble_benchmark(plans, plan_index,
+                                            arrays['feature_values'],
+                                            bin_edges, true_hist,
+                                            iterations_step)
+
+def run_benchmarks(ensemble_paths,
+                   plan_index,
+                   feature_values,
+                   feature_hist_bins,
+                   iterations_step,
+                   processes=None,
+                   verbose=False,
+                   chunk_size=None):
+    # same output as get_benchmark_data(load_plans(ensemble_paths), ...),
+    # with ensembles in the order of ensemble_paths. With chunk_size, each
+    # ensemble is streamed from disk chunk_size steps at a time (see
+    # get_streamed_benchmark) instead of being loaded whole
+    true_hist, bin_edges = np.histogram(feature_values,
+                                        bins=feature_hist_bins,
+                                        density=True)
+
+    shared_blocks = []
+    try:
+        specs = {
+            'plans': share_array(plan_index.plans, shared_blocks),
+            'sorted_hashes': share_array(plan_index.sorted_hashes, shared_blocks),
+            'order': share_array(plan_index.order, shared_blocks),
+            'feature_values': share_array(feature_values, shared_blocks)
+        }
+        results = {}
+        with ProcessPoolExecutor(max_workers=processes,
+                                 initializer=attach_arrays,
+                                 initargs=(specs,)) as executor:
+            futures = [executor.submit(benchmark_ensemble, ensemble, path,
+                                       bin_edges, true_hist, iterations_step,
+                                       chunk_size)
+                       for (ensemble, path) in ensemble_paths.items()]
+            for future in futures:
+                ensemble, benchmark = future.result()
+                if verbose:
+                    print('computed benchmark data for ' + ensemble)
+                results[ensemble] = benchmark
+    finally:
+        for block in shared_blocks:
+            block.close()
+            block.unlink()
+
+    return {
+        'true_hist': true_hist,
+        'bin_edges': bin_edges,
+        'total_num_plans': len(plan_index),
+        'benchmarks_by_ensemble': results,
+        'iterations_step': iterations_step
+    }
+
+def sketch_ensemble(ensemble, path, iterations_step, chunk_size, sketch_params):
+    chunks = iter_ensemble_chunks(path, chunk_size)
+    return ensemble, get_sketched_benchmark(chunks, iterations_step,
+                                            **sketch_params)
+
+def run_sketched_benchmarks(ensemble_paths,
+                            iterations_step,
+                            chunk_size=1000000,
+                            processes=None,
+                            verbose=False,
+                            **sketch_params):
+    # approximate exploration benchmarks (see get_sketched_benchmark) of
+    # ensembles on a graph with no enumeration, one worker per ensemble.
+    # sketch_params (error, epsilon, delta, top) set the error bounds. The
+    # sketches of all the ensembles are merged into estimates of the number
+    # of distinct plans and the visit counts of the most visited plans over
+    # every chain. estimated_num_plans is a HyperLogLog estimate (a float),
+    # not the count of an enumeration, and there is no true feature
+    # histogram, so the output has no true_hist, bin_edges or
+    # total_num_plans and can't be passed to plot_exploration_benchmarks or
+    # plot_mixing_benchmarks, whose per-ensemble entries it lacks too
+    results = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(sketch_ensemble, ensemble, path,
+                                   iterations_step, chunk_size, sketch_params)
+                   for (ensemble, path) in ensemble_paths.items()]
+        for future in futures:
+            ensemble, benchmark = future.result()
+            if verbose:
+                print('computed sketched benchmark data for ' + ensemble)
+            results[ensemble] = benchmark
+    
+    distinct_sketch = merge_sketches(
+        [benchmark['distinct_sketch'] for benchmark in results.values()])
+    frequency_sketch = merge_sketches(
+        [benchmark['frequency_sketch'] for benchmark in results.values()])
+    
+    return {
+        'estimated_num_plans': distinct_sketch.count(),
+        'sorted_plan_freqs': frequency_sketch.heaviest()[1][::-1],
+        'benchmarks_by_ensemble': results,
+        'iterations_step': iterations_step
+    }
@@ -5,83 +5,260 @@ Created on Wed Jul 25 11:56:01 2018
 @author: Sloan
 """
 import numpy as np
-import pickle
-from utils import canonical_form
+# the top level modules of the repo are put on the path by the entry points (main.py, pipeline.py)
+from benchmark_calculations import canonical_array, plan_chunks
+from chain_codec import load_chain
+from ensemble_format import load_ensemble, iter_ensemble, load_pickled_plans
+from feature_store import hist_bin_indices
+from plan_index import plan_frequencies, first_visits, plan_hashes
+from sketches import HyperLogLog, CountMinSketch
+
+def load_ensemble_plans(path):
+    # ensemble files (.ens) are already canonical and are memory mapped
+    # instead of read, encoded chains (.npz) are decoded, pickles are loaded
+    # whole and canonicalized. A function (like chain_sim.simulate_plans with
+    # its arguments bound) is called to produce the plans instead
+    if callable(path):
+        return path()
+    if path.endswith('.ens'):
+        return load_ensemble(path)
+    if path.endswith('.npz'):
+        return np.concatenate(list(load_chain(path).iter_plans()))
+    return canonical_array(load_pickled_plans(path))
+
+def iter_ensemble_chunks(path, chunk_size=1000000):
+    # yields the canonical plans of an ensemble as (chunk_size x num_nodes)
+    # arrays read from disk one block at a time: ensemble files (.ens) and
+    # encoded chains (.npz, see chain_codec.py) are streamed, a function is
+    # called and its output (an array or an iterable of chunks) split up, and
+    # pickles, which can't be read in parts, are loaded whole
+    if callable(path):
+        chunks = plan_chunks(path(), chunk_size)
+    elif path.endswith('.ens'):
+        chunks = iter_ensemble(path, chunk_size)
+    elif path.endswith('.npz'):
+        chunks = load_chain(path).iter_plans(chunk_size)
+    else:
+        chunks = plan_chunks(load_ensemble_plans(path), chunk_size)
+    for chunk in chunks:
+        yield canonical_array(chunk) if callable(path) else chunk
 
 def load_plans(ensemble_paths):
     plans_by_ensemble = dict()
     
     for (ensemble, path) in ensemble_paths.items():
-        # load sampled ensemble, collect unique plans
-        with open(path, 'rb') as f:
-            raw_plans = pickle.load(f)
-        plans = [canonical_form(plan) for plan in raw_plans]
-        plans_by_ensemble[ensemble] = plans
+        plans_by_ensemble[ensemble] = load_ensemble_plans(path)
     
     return plans_by_ensemble
     
+def running_bin_counts(bins, checkpoints, num_bins):
+    # (len(checkpoints) x num_bins) counts of each bin among the first i bin
+    # indices, for every i in checkpoints (bins of -1 aren't counted)
+    counts = np.empty((len(checkpoints), num_bins))
+    for b in range(num_bins):
+        counts[:, b] = np.cumsum(bins == b)[checkpoints - 1]
+    return counts
+
+def hist_errors_from_counts(counts, bin_edges, true_hist):
+    # L1 distance between true_hist and the density histogram of each row of
+    # bin counts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        density = counts / counts.sum(axis=1, keepdims=True) / np.diff(bin_edges)
+    return np.sum(np.abs(density - true_hist), axis=1)
+
+def running_hist_errors(values, counted, checkpoints, bin_edges, true_hist):
+    # L1 distance between true_hist and the density histogram of the counted
+    # values among the first i, for every i in checkpoints. Uses cumulative
+    # bin counts, so the cost doesn't depend on the number of checkpoints
+    bins = hist_bin_indices(values, bin_edges)
+    bins[~counted] = -1
+    counts = running_bin_counts(bins, checkpoints, len(bin_edges) - 1)
+    return hist_errors_from_counts(counts, bin_edges, true_hist)
+    
+def get_ensemble_benchmark(plans,
+                           plan_index,
+                           feature_values,
+                           bin_edges,
+                           true_hist,
+                           iterations_step):
+    # benchmark data of one sampled ensemble, plans are identified by their
+    # row in the full ensemble (plan_index), and feature_values[plan_id] is
+    # the feature of that plan
+    ids = plan_index.lookup(plans)
+    features = feature_values[ids]
+    hist = np.histogram(features, bins=bin_edges, density=True)[0]
+    
+    # unique plans in the order they were first visited
+    unique_ids, first_steps = np.unique(ids, return_index=True)
+    unique_ids = unique_ids[np.argsort(first_steps)]
+    set_features = feature_values[unique_ids]
+    set_hist = np.histogram(set_features, bins=bin_edges, density=True)[0]
+    
+    # running curves at each checkpoint i (the first i steps), all computed
+    # in one pass from per-step bin indices and a first visit marker
+    checkpoints = np.arange(1, len(ids), iterations_step)
+    visited_first = first_visits(ids)
+    hist_errors = running_hist_errors(features, np.ones(len(ids), dtype=bool),
+                                      checkpoints, bin_edges, true_hist)
+    set_hist_errors = running_hist_errors(features, visited_first,
+                                          checkpoints, bin_edges, true_hist)
+    exploration_counts = np.cumsum(visited_first)[checkpoints - 1]
+    
+    # plans never visited are the zero counts at the front
+    plan_freqs = plan_frequencies(ids, len(plan_index))
+    sorted_plan_freqs = np.sort(plan_freqs)
+    
+    return {
+        'hist': hist,
+        'set_hist': set_hist,
+        'hist_errors': hist_errors,
+        'set_hist_errors': set_hist_errors,
+        'sorted_plan_freqs': sorted_plan_freqs,
+        'exploration_counts': exploration_counts
+    }
+
+def get_streamed_benchmark(chunks,
+                           plan_index,
+                           feature_values,
+                           bin_edges,
+                           true_hist,
+                           iterations_step):
+    # same output as get_ensemble_benchmark for an ensemble given as an
+    # iterable of (num_steps x num_nodes) chunks of canonical plans, like
+    # iter_ensemble_chunks, so chains larger than memory can be benchmarked.
+    # Only one chunk is held at a time: histograms, plan frequencies and the
+    # set of visited plans (a bitmap over the plan IDs of plan_index) are
+    # updated chunk by chunk, and the running curves at the checkpoints
+    # within a chunk are computed from the totals of the chunks before it.
+    # Memory grows with the chunk size and the size of the full ensemble,
+    # not with the length of the chain (besides the curves themselves)
+    num_bins = len(bin_edges) - 1
+    seen = np.zeros(len(plan_index), dtype=bool)
+    plan_freqs = np.zeros(len(plan_index), dtype=np.int64)
+    hist_counts = np.zeros(num_bins)
+    set_hist_counts = np.zeros(num_bins)
+    num_seen = 0
+    hist_errors, set_hist_errors, exploration_counts, checkpoints = [], [], [], []
+    start = 0
+    for chunk in chunks:
+        ids = plan_index.lookup(chunk)
+        bins = hist_bin_indices(feature_values[ids], bin_edges)
+        
+        # plans visited for the first time in this chunk, at their first step
+        unique_ids, first_steps = np.unique(ids, return_index=True)
+        new_steps = first_steps[~seen[unique_ids]]
+        visited_first = np.zeros(len(ids), dtype=bool)
+        visited_first[new_steps] = True
+        seen[ids[new_steps]] = True
+        set_bins = np.where(visited_first, bins, -1)
+        
+        # checkpoints 1, 1 + iterations_step... (counted from the start of the
+        # chain) that fall in this chunk
+        first_checkpoint = 1 + -(-start // iterations_step) * iterations_step
+        chunk_checkpoints = np.arange(first_checkpoint, start + len(ids) + 1,
+                                      iterations_step)
+        local = chunk_checkpoints - start
+        hist_errors.append(hist_errors_from_counts(
+            hist_counts + running_bin_counts(bins, local, num_bins),
+            bin_edges, true_hist))
+        set_hist_errors.append(hist_errors_from_counts(
+            set_hist_counts + running_bin_counts(set_bins, local, num_bins),
+            bin_edges, true_hist))
+        exploration_counts.append(num_seen + np.cumsum(visited_first)[local - 1])
+        checkpoints.append(chunk_checkpoints)
+        
+        hist_counts += np.bincount(bins[bins >= 0], minlength=num_bins)
+        set_hist_counts += np.bincount(set_bins[set_bins >= 0], minlength=num_bins)
+        plan_freqs += np.bincount(ids, minlength=len(plan_index))
+        num_seen += len(new_steps)
+        start += len(ids)
+    
+    # checkpoints stop short of the last step, as in get_ensemble_benchmark
+    checkpoints = np.concatenate(checkpoints) if checkpoints else np.zeros(0, dtype=int)
+    kept = checkpoints < start
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hist = hist_counts / hist_counts.sum() / np.diff(bin_edges)
+        set_hist = set_hist_counts / set_hist_counts.sum() / np.diff(bin_edges)
+    
+    return {
+        'hist': hist,
+        'set_hist': set_hist,
+        'hist_errors': np.concatenate(hist_errors)[kept] if hist_errors else np.zeros(0),
+        'set_hist_errors': np.concatenate(set_hist_errors)[kept] if set_hist_errors else np.zeros(0),
+        'sorted_plan_freqs': np.sort(plan_freqs),
+        'exploration_counts': np.concatenate(exploration_counts)[kept] if exploration_counts else np.zeros(0, dtype=int)
+    }
+
+def get_sketched_benchmark(chunks,
+                           iterations_step,
+                           error=0.01,
+                           epsilon=1e-4,
+                           delta=0.01,
+                           top=1000):
+    # approximate exploration_counts and sorted_plan_freqs of an ensemble
+    # given as an iterable of chunks of canonical plans (like
+    # iter_ensemble_chunks), for graphs that can't be enumerated. Visited
+    # plans are kept in fixed-size sketches (see sketches.py) instead of an
+    # exact set and counts: exploration_counts is a HyperLogLog estimate with
+    # relative error about error at each checkpoint, sorted_plan_freqs holds
+    # the visit counts of the top most visited plans (in increasing order, as
+    # the tail of the exact sorted_plan_freqs), overestimated by at most
+    # epsilon times the number of steps with probability 1 - delta. The
+    # sketches are returned too, so those of several chains or workers can be
+    # merged with sketches.merge_sketches
+    distinct_sketch = HyperLogLog(error)
+    frequency_sketch = CountMinSketch(epsilon, delta, top)
+    exploration_counts, checkpoints = [], []
+    start = 0
+    for chunk in chunks:
+        hashes = plan_hashes(chunk)
+        if hashes.ndim == 0:
+            hashes = hashes.reshape(1)
+        
+        # same checkpoints as get_streamed_benchmark
+        first_checkpoint = 1 + -(-start // iterations_step) * iterations_step
+        chunk_checkpoints = np.arange(first_checkpoint, start + len(hashes) + 1,
+                                      iterations_step)
+        exploration_counts.append(distinct_sketch.running_counts(
+            hashes, chunk_checkpoints - start))
+        checkpoints.append(chunk_checkpoints)
+        frequency_sketch.add(hashes)
+        start += len(hashes)
+    
+    checkpoints = np.concatenate(checkpoints) if checkpoints else np.zeros(0, dtype=int)
+    kept = checkpoints < start
+    
+    return {
+        'sorted_plan_freqs': frequency_sketch.heaviest()[1][::-1],
+        'exploration_counts': np.concatenate(exploration_counts)[kept] if exploration_counts else np.zeros(0),
+        'num_steps': start,
+        'estimated_num_plans': distinct_sketch.count(),
+        'distinct_sketch': distinct_sketch,
+        'frequency_sketch': frequency_sketch
+    }
+
 def get_benchmark_data(plans_by_ensemble,
-                       feature_table,
+                       plan_index,
+                       feature_values,
                        feature_hist_bins,
                        iterations_step,
                        verbose=False):
-    true_hist, bin_edges = np.histogram(list(feature_table.values()),
+    true_hist, bin_edges = np.histogram(feature_values,
                                         bins=feature_hist_bins,
                                         density=True)
-    total_num_plans = len(feature_table)
         
     benchmarks_by_ensemble = {}
     for (ensemble, plans) in plans_by_ensemble.items():
         if verbose:
             print('computing benchmark data for ' + ensemble)
-            
-        features = [feature_table[plan] for plan in plans]
-        hist = np.histogram(features, bins=bin_edges, density=True)[0]
-        
-        unique_plans = set(plans)
-        set_features = [feature_table[plan] for plan in unique_plans]
-        set_hist = np.histogram(set_features, bins=bin_edges, density=True)[0]
-        
-        hist_errors = []
-        set_hist_errors = []
-        exploration_counts = []
-        for i in range(1, len(plans), iterations_step):
-            curr_features = features[:i]
-            curr_hist = np.histogram(curr_features, bins=bin_edges, density=True)[0]
-            
-            curr_unique_plans = set(plans[:i])
-            exploration_count = len(curr_unique_plans)
-            curr_set_features = set_features[:exploration_count]
-            curr_set_hist = np.histogram(curr_set_features, bins=bin_edges, density=True)[0]
-            
-            hist_error = np.sum(np.abs(curr_hist - true_hist))
-            set_hist_error = np.sum(np.abs(curr_set_hist - true_hist))
-            
-            hist_errors.append(hist_error)
-            set_hist_errors.append(set_hist_error)
-            exploration_counts.append(exploration_count)
-        
-        plan_freqs = {}
-        for plan in plans:
-            if plan in plan_freqs:
-                plan_freqs[plan] += 1
-            else: plan_freqs[plan] = 1
-        unseen = total_num_plans - len(unique_plans)
-        sorted_plan_freqs = ([0] * unseen) + sorted(plan_freqs.values())
-        
-        benchmarks_by_ensemble[ensemble] = {
-            'hist': hist,
-            'set_hist': set_hist,
-            'hist_errors': hist_errors,
-            'set_hist_errors': set_hist_errors,
-            'sorted_plan_freqs': sorted_plan_freqs,
-            'exploration_counts': exploration_counts
-        }
+        benchmarks_by_ensemble[ensemble] = get_ensemble_benchmark(
+            plans, plan_index, feature_values, bin_edges, true_hist,
+            iterations_step)
         
     return {
         'true_hist': true_hist,
         'bin_edges': bin_edges,
-        'total_num_plans': total_num_plans,
+        'total_num_plans': len(plan_index),
         'benchmarks_by_ensemble': benchmarks_by_ensemble,
         'iterations_step': iterations_step
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,221 @@
+import numpy as np
+import math
+import sys
+from ensemble_format import iter_ensemble
+from plan_index import mix64, plan_hashes
+
+
+#This file keeps fixed-size probabilistic summaries of the plans a chain visits, for graphs too large to
+#enumerate, where the exact benchmarks (a set of every visited plan and a count per plan) don't fit in memory.
+#Plans are summarized by their 64 bit hash (plan_index.plan_hashes), and sketches are updated with whole arrays of
+#hashes, a chunk of the chain at a time. Two sketches built with the same parameters can be merged, so chains run
+#on different workers (or pieces of one chain) are summarized separately and combined afterwards; the merged
+#sketch is the same as one built from all the plans.
+#
+#HyperLogLog counts distinct plans with a relative standard error of about 1.04 / sqrt(2**precision), using
+#2**precision one byte registers (16 KB for an error of 1%).
+#CountMinSketch counts visits to each plan, overestimating by at most epsilon * (total visits) with probability
+#1 - delta, using ceil(e / epsilon) x ceil(ln(1 / delta)) counters (1 MB for epsilon = 1e-4, delta = 0.01), and
+#tracks the top most visited plans.
+#
+#Functions:
+#
+#HyperLogLog : mergeable estimate of the number of distinct plans
+#CountMinSketch : mergeable estimate of visit counts, with the most visited plans
+#merge_sketches : merges a list of sketches into a new one
+#
+#From the command line, python sketches.py ensemble.ens [error] prints the estimated number of distinct plans and
+#the visit counts of the most visited ones
+
+
+SKETCH_SEED = 20181018
+
+
+#Number of leading zero bits of each value of a uint64 array
+def leading_zeros(values):
+	values = values.copy()
+	zeros = np.zeros(len(values), dtype = np.int64)
+	for shift in (32, 16, 8, 4, 2, 1):
+		small = (values >> np.uint64(64 - shift)) == 0
+		zeros += shift * small
+		values[small] <<= np.uint64(shift)
+	zeros[values == 0] = 64
+	return zeros
+
+
+#Ex: sketch = HyperLogLog(error = 0.01)
+#	sketch.add(plan_hashes(plans))
+#	sketch.count()                                  #estimated number of distinct plans added
+#	sketch.merge(other_chain_sketch)                #now counts the plans of both
+class HyperLogLog:
+
+	def __init__(self, error = 0.01, precision = None):
+		if precision is None:
+			precision = int(math.ceil(2 * math.log2(1.04 / error)))
+		self.precision = min(max(precision, 4), 18)
+		self.registers = np.zeros(2**self.precision, dtype = np.uint8)
+
+	def __len__(self):
+		return len(self.registers)
+
+	@property
+	def error(self):
+		return 1.04 / math.sqrt(len(self.registers))
+
+	@property
+	def nbytes(self):
+		return self.registers.nbytes
+
+	def copy(self):
+		sketch = HyperLogLog(precision = self.precision)
+		sketch.registers[:] = self.registers
+		return sketch
+
+	#Adds an array of 64 bit hashes. The first precision bits of a hash pick a register, which keeps the largest
+	#position of the first set bit among the remaining bits
+	def add(self, hashes):
+		hashes = np.asarray(hashes, dtype = np.uint64).ravel()
+		if len(hashes) == 0:
+			return
+		registers = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+		rest = hashes << np.uint64(self.precision)
+		ranks = np.minimum(leading_zeros(rest) + 1, 64 - self.precision + 1).astype(np.uint8)
+		np.maximum.at(self.registers, registers, ranks)
+
+	#Estimated number of distinct hashes added, with the small range (linear counting) correction
+	def count(self):
+		m = len(self.registers)
+		alpha = {16 : 0.673, 32 : 0.697, 64 : 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+		estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+		empty = np.count_nonzero(self.registers == 0)
+		if estimate <= 2.5 * m and empty > 0:
+			estimate = m * math.log(m / empty)
+		return estimate
+
+	#Estimated number of distinct hashes after each step of checkpoints, given as numbers of hashes counted from
+	#the start of hashes (increasing, at most len(hashes)). Adds all the hashes
+	def running_counts(self, hashes, checkpoints):
+		counts = np.empty(len(checkpoints))
+		start = 0
+		for (i, checkpoint) in enumerate(checkpoints):
+			self.add(hashes[start:checkpoint])
+			start = checkpoint
+			counts[i] = self.count()
+		self.add(hashes[start:])
+		return counts
+
+	def merge(self, other):
+		if other.precision != self.precision:
+			raise ValueError('cannot merge HyperLogLog sketches of precision %d and %d' %
+							(self.precision, other.precision))
+		np.maximum(self.registers, other.registers, out = self.registers)
+		return self
+
+
+#Ex: sketch = CountMinSketch(epsilon = 1e-4, delta = 0.01, top = 1000)
+#	sketch.add(plan_hashes(plans))
+#	sketch.estimate(plan_hashes(some_plans))        #visit counts, never below the true counts
+#	hashes, counts = sketch.heaviest()              #most visited plans, most visited first
+class CountMinSketch:
+
+	def __init__(self, epsilon = 1e-4, delta = 0.01, top = 1000, width = None, depth = None):
+		self.width = width if width is not None else int(math.ceil(math.e / epsilon))
+		self.depth = depth if depth is not None else max(1, int(math.ceil(math.log(1 / delta))))
+		self.top = top
+		self.table = np.zeros((self.depth, self.width), dtype = np.int64)
+		self.seeds = np.random.default_rng(SKETCH_SEED).integers(0, 2**64, size = self.depth, dtype = np.uint64)
+		self.total = 0
+		#hashes of the most visited plans so far
+		self.heavy = np.zeros(0, dtype = np.uint64)
+
+	@property
+	def epsilon(self):
+		return math.e / self.width
+
+	@property
+	def delta(self):
+		return math.exp(-self.depth)
+
+	@property
+	def nbytes(self):
+		return self.table.nbytes + self.heavy.nbytes
+
+	def copy(self):
+		sketch = CountMinSketch(top = self.top, width = self.width, depth = self.depth)
+		sketch.table[:] = self.table
+		sketch.total = self.total
+		sketch.heavy = self.heavy.copy()
+		return sketch
+
+	#Column of each hash in each row, as a (depth x num_hashes) array
+	def columns(self, hashes):
+		return np.array([mix64(hashes ^ seed) % np.uint64(self.width) for seed in self.seeds], dtype = np.intp)
+
+	#Adds an array of 64 bit hashes, each counted once per occurrence (or counts[i] times for hashes[i])
+	def add(self, hashes, counts = None):
+		hashes = np.asarray(hashes, dtype = np.uint64).ravel()
+		if counts is None:
+			hashes, counts = np.unique(hashes, return_counts = True)
+		if len(hashes) == 0:
+			return
+		for (row, columns) in enumerate(self.columns(hashes)):
+			np.add.at(self.table[row], columns, counts)
+		self.total += int(np.sum(counts))
+		self.update_heavy(hashes)
+
+	#Keeps the top most visited among the current heavy hashes and candidates
+	def update_heavy(self, candidates):
+		candidates = np.union1d(self.heavy, candidates)
+		if len(candidates) > self.top:
+			candidates = candidates[np.argpartition(-self.estimate(candidates), self.top - 1)[:self.top]]
+		self.heavy = candidates
+
+	#Estimated visit counts of an array of hashes
+	def estimate(self, hashes):
+		hashes = np.asarray(hashes, dtype = np.uint64).ravel()
+		if len(hashes) == 0:
+			return np.zeros(0, dtype = np.int64)
+		columns = self.columns(hashes)
+		return np.min(self.table[np.arange(self.depth)[:, np.newaxis], columns], axis = 0)
+
+	#Hashes and estimated visit counts of the top most visited plans, most visited first
+	def heaviest(self):
+		counts = self.estimate(self.heavy)
+		order = np.argsort(-counts, kind = 'stable')
+		return self.heavy[order], counts[order]
+
+	def merge(self, other):
+		if (other.width, other.depth) != (self.width, self.depth):
+			raise ValueError('cannot merge count-min sketches of shape %s and %s' %
+							((self.depth, self.width), (other.depth, other.width)))
+		self.table += other.table
+		self.total += other.total
+		self.update_heavy(other.heavy)
+		return self
+
+
+#New sketch summarizing everything added to a list of sketches of the same kind and parameters
+def merge_sketches(sketches):
+	sketches = list(sketches)
+	if not sketches:
+		raise ValueError('no sketches to merge')
+	merged = sketches[0].copy()
+	for sketch in sketches[1:]:
+		merged.merge(sketch)
+	return merged
+
+
+if __name__ == '__main__':
+	if len(sys.argv) not in (2, 3):
+		print('usage: python sketches.py ensemble.ens [error]')
+		sys.exit(1)
+	error = float(sys.argv[2]) if len(sys.argv) == 3 else 0.01
+	distinct = HyperLogLog(error)
+	frequencies = CountMinSketch(top = 10)
+	for plans in iter_ensemble(sys.argv[1]):
+		hashes = plan_hashes(plans)
+		distinct.add(hashes)
+		frequencies.add(hashes)
+	print('%d steps, about %d distinct plans (+/- %.1f%%)' % (frequencies.total, round(distinct.count()),
+															100 * distinct.error))
+	print('visits to the most visited plans: ' + ', '.join(str(count) for count in frequencies.heaviest()[1]))
@@ -0,0 +1,127 @@
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.csgraph as csgraph
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from contiguity import graph_adjacency
+from graph_data import GraphData, node_ordering
+
+
+#This file draws random contiguous partitions of a graph by cutting random spanning trees, replacing the
+#gerrymandr/spanning_trees dependency of create_towers. Districts are split off one at a time: a random spanning
+#tree of the nodes not yet assigned is drawn (a minimum spanning tree under random edge weights), and a tree edge
+#is cut whose two sides have populations that fit one district and the remaining districts. Both sides of a
+#tree edge are connected, so every district is contiguous. When no edge of a tree fits, the partition is
+#started over with new trees.
+#
+#Population constraint (as in create_towers), with ideal_pop = total population / num_dists:
+#	allowed population minimum = ideal_pop - ideal_pop * pop_constraint
+#	allowed population maximum = ideal_pop + ideal_pop * pop_constraint
+#When these bounds allow any population (like the default pop_constraint of 100), populations aren't read.
+#
+#Functions:
+#
+#graph_arrays : adjacency matrix and node populations of a networkx graph (or a GraphData), in sorted node order
+#random_spanning_tree : random spanning tree of a graph given as an adjacency matrix
+#split_tree : picks a random tree edge to cut off one district within the population bounds
+#random_partition : one random partition into num_dists contiguous districts
+#random_partitions : many random partitions, optionally drawn in parallel across processes
+
+
+#Outputs (adjacency, pops) where adjacency is a symmetric scipy CSR matrix and pops is a float array, both
+#indexed by position in sorted(graph.nodes). Without pop_name every node has population 1
+def graph_arrays(graph, pop_name = 'POP'):
+	if isinstance(graph, GraphData):
+		return graph.adjacency(), (np.ones(len(graph)) if pop_name is None else graph.attribute(pop_name))
+	nodes = node_ordering(graph).nodes.tolist()
+	if pop_name is None:
+		pops = np.ones(len(nodes))
+	else:
+		pops = np.array([graph.nodes[node][pop_name] for node in nodes], dtype = float)
+	return graph_adjacency(graph), pops
+
+
+def random_spanning_tree(adjacency, rng):
+	edges = sparse.triu(adjacency, k = 1).tocoo()
+	#weights are kept away from 0, which csgraph treats as a missing edge
+	weights = sparse.coo_matrix((1 + rng.random(len(edges.row)), (edges.row, edges.col)), shape = adjacency.shape)
+	tree = csgraph.minimum_spanning_tree(weights)
+	return (tree + tree.T).tocsr()
+
+
+#Finds the tree edges where cutting leaves one side with a population in [low, high] and the other side with a
+#population num_dists - 1 districts can share, and cuts one of them at random. Outputs a boolean mask of the
+#nodes cut off as the new district, or None when no edge works
+def split_tree(tree, pops, num_dists, low, high, rng):
+	order, parents = csgraph.breadth_first_order(tree, 0, directed = False)
+	if len(order) < tree.shape[0]:
+		raise ValueError('graph is not connected')
+	subtree_pops = pops.astype(float)
+	for node in order[:0:-1]:
+		subtree_pops[parents[node]] += subtree_pops[node]
+	rest_pops = subtree_pops[order[0]] - subtree_pops
+	rest_low, rest_high = (num_dists - 1) * low, (num_dists - 1) * high
+
+	#cut below node v and keep either side of the edge (v, parent of v) as the district
+	edges = order[1:]
+	below = edges[(subtree_pops[edges] >= low) & (subtree_pops[edges] <= high) &
+				(rest_pops[edges] >= rest_low) & (rest_pops[edges] <= rest_high)]
+	above = edges[(rest_pops[edges] >= low) & (rest_pops[edges] <= high) &
+				(subtree_pops[edges] >= rest_low) & (subtree_pops[edges] <= rest_high)]
+	if len(below) + len(above) == 0:
+		return None
+	choice = rng.integers(len(below) + len(above))
+	cut = below[choice] if choice < len(below) else above[choice - len(below)]
+
+	in_subtree = np.zeros(len(pops), dtype = bool)
+	in_subtree[cut] = True
+	for node in order[np.flatnonzero(order == cut)[0] + 1:]:
+		in_subtree[node] = in_subtree[parents[node]]
+	return in_subtree if choice < len(below) else ~in_subtree
+
+
+#Draws one partition of the graph into num_dists contiguous districts with populations in [low, high]. Outputs
+#an array of district labels 1 to num_dists indexed like adjacency
+def random_partition(adjacency, pops, num_dists, low, high, rng, max_attempts = 10000):
+	for attempt in range(max_attempts):
+		assignment = np.full(len(pops), num_dists)
+		remaining = np.arange(len(pops))
+		for district in range(1, num_dists):
+			subgraph = adjacency[remaining][:, remaining]
+			tree = random_spanning_tree(subgraph, rng)
+			district_mask = split_tree(tree, pops[remaining], num_dists - district + 1, low, high, rng)
+			if district_mask is None:
+				break
+			assignment[remaining[district_mask]] = district
+			remaining = remaining[~district_mask]
+		else:
+			return assignment
+	raise ValueError('no partition within the population constraint found in %d attempts' % max_attempts)
+
+
+def sample_partition(adjacency, pops, num_dists, low, high, seed):
+	return random_partition(adjacency, pops, num_dists, low, high, np.random.default_rng(seed))
+
+
+#Draws num_partitions random partitions of graph into num_dists contiguous districts, outputs them as a
+#(num_partitions x num_nodes) array with nodes in sorted order and labels 1 to num_dists. Each partition gets
+#its own random stream spawned from seed, so the output only depends on seed and not on the number of
+#processes (1 to draw in this process, None for one per CPU). Worker processes are only started on request, as
+#they need the calling script to have an if __name__ == '__main__' guard on platforms that spawn them
+def random_partitions(graph, num_dists, num_partitions, pop_constraint = 100, pop_name = 'POP', seed = None,
+						processes = 1):
+	#with pop_constraint >= 1 and >= num_dists - 1 every district population (0 to the total) is allowed, so every
+	#tree edge fits whatever the populations are, and graphs without a pop_name attribute work too
+	if pop_constraint >= max(1, num_dists - 1):
+		pop_name = None
+	adjacency, pops = graph_arrays(graph, pop_name)
+	ideal_pop = pops.sum() / num_dists
+	low, high = ideal_pop - ideal_pop * pop_constraint, ideal_pop + ideal_pop * pop_constraint
+	seeds = np.random.SeedSequence(seed).spawn(num_partitions)
+	sample = partial(sample_partition, adjacency, pops, num_dists, low, high)
+	if processes == 1:
+		partitions = [sample(s) for s in seeds]
+	else:
+		with ProcessPoolExecutor(max_workers = processes) as executor:
+			partitions = list(executor.map(sample, seeds, chunksize = max(1, num_partitions // 64)))
+	return np.array(partitions).reshape(num_partitions, len(pops))